@@ -0,0 +1,179 @@
+import os, math, time
+import faiss, numpy as np
+from typing import Optional, List, Dict, Iterable, Tuple
+
+# index type per partition: "auto" picks by vector count, anything else forces that type
+ANN_INDEX = os.getenv("ANN_INDEX", "auto")            # auto | flat | hnsw | ivf_flat | ivf_pq
+ANN_HNSW_MIN = int(os.getenv("ANN_HNSW_MIN", "20000"))     # below this, exact scan
+ANN_IVF_MIN = int(os.getenv("ANN_IVF_MIN", "500000"))      # HNSW below this
+ANN_IVFPQ_MIN = int(os.getenv("ANN_IVFPQ_MIN", "5000000"))  # IVF-Flat below this, IVF-PQ above
+ANN_HNSW_M = int(os.getenv("ANN_HNSW_M", "32"))
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "16"))
+ANN_EF_SEARCH = int(os.getenv("ANN_EF_SEARCH", "64"))
+ANN_CATCHUP = float(os.getenv("ANN_CATCHUP", "0.1"))  # re-index once the unindexed tail exceeds this fraction
+# a corpus covering less than this fraction of its file is scanned exactly; above it, efSearch /
+# nprobe grow by 1/fraction so the ID filter still leaves enough candidates
+ANN_FILTER_MIN = float(os.getenv("ANN_FILTER_MIN", "0.1"))
+
+# how vectors are held in the search index; the float32 file on disk stays the source of truth
+VECTOR_CODEC = os.getenv("VECTOR_CODEC", "none")      # none | fp16 | sq8 | pq
+VECTOR_RERANK = int(os.getenv("VECTOR_RERANK", "4"))  # lossy indexes: re-score k*N candidates exactly; 0/1 = off
+
+KINDS = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+CODECS = ("none", "fp16", "sq8", "pq")
+
+def choose_kind(n: int) -> str:
+    if ANN_INDEX != "auto": return ANN_INDEX
+    if n < ANN_HNSW_MIN: return "flat"
+    if n < ANN_IVF_MIN: return "hnsw"
+    if n < ANN_IVFPQ_MIN: return "ivf_flat"
+    return "ivf_pq"
+
+def nlist_for(n: int) -> int:
+    return int(min(max(16, 4 * math.sqrt(n)), 65536))
+
+def pq_m_for(d: int) -> int:
+    # most sub-quantizers that still leave >= 4 dims each (384 dims -> 64 bytes/vector)
+    for m in (96, 64, 48, 32, 24, 16, 12, 8, 4):
+        if d % m == 0 and d // m >= 4: return m
+    return 1
+
+def needs_index(kind: str, codec: str = VECTOR_CODEC, n: int = 0) -> bool:
+    # uncompressed flat is the mmapped float32 scan itself; PQ needs enough rows to train 256 centroids
+    if kind == "flat" and codec == "none": return False
+    return not (codec == "pq" or kind == "ivf_pq") or n >= 4096
+
+def is_lossy(kind: str, codec: str = VECTOR_CODEC) -> bool:
+    return codec != "none" or kind == "ivf_pq"
+
+def _codes(d: int, codec: str, hnsw: bool = False) -> str:
+    if codec == "none": return "Flat"
+    if codec == "fp16": return "SQfp16"
+    # faiss' HNSW+PQ only ranks by L2, so HNSW falls back to 8-bit SQ
+    if codec == "sq8" or hnsw: return "SQ8"
+    return f"PQ{pq_m_for(d)}"
+
+def factory_spec(kind: str, d: int, n: int, codec: str = VECTOR_CODEC) -> str:
+    if kind == "flat":
+        # a single inverted list is a flat scan over the codes that still honours ID selectors
+        return f"IVF1,{_codes(d, codec)}"
+    if kind == "hnsw":
+        return f"HNSW{ANN_HNSW_M}" if codec == "none" else f"HNSW{ANN_HNSW_M},{_codes(d, codec, hnsw=True)}"
+    if kind == "ivf_flat":
+        return f"IVF{nlist_for(n)},{_codes(d, codec)}"
+    if kind == "ivf_pq":
+        return f"IVF{nlist_for(n)},PQ{pq_m_for(d)}"
+    raise ValueError(f"unknown ANN index type {kind!r}")
+
+def needs_retrain(kind: str, trained_on: int, n: int, codec: str = VECTOR_CODEC) -> bool:
+    # IVF centroids are sized for the count they were trained on; PQ codebooks for the sample they saw
+    return (kind.startswith("ivf") or codec == "pq") and n > 4 * max(trained_on, 1)
+
+def _add(index: faiss.Index, vecs: np.ndarray, start: int, end: int, step: int = 65536):
+    # rows go in order, so faiss ids are row numbers; batches keep mmap page-ins bounded
+    for a in range(start, end, step):
+        index.add(np.ascontiguousarray(vecs[a:min(a + step, end)], dtype="float32"))
+
+def build(kind: str, vecs: np.ndarray, n: int, codec: str = VECTOR_CODEC) -> faiss.Index:
+    d = vecs.shape[1]
+    index = faiss.index_factory(d, factory_spec(kind, d, n, codec), faiss.METRIC_INNER_PRODUCT)
+    if kind == "hnsw":
+        index.hnsw.efConstruction = 80
+    if not index.is_trained:
+        size = min(n, max(nlist_for(n) * 64, 65536))
+        sample = np.sort(np.random.default_rng(0).choice(n, size=size, replace=False))
+        index.train(np.ascontiguousarray(vecs[sample], dtype="float32"))
+    _add(index, vecs, 0, n)
+    return index
+
+def extend(path: str, vecs: np.ndarray, start: int, end: int) -> faiss.Index:
+    # add new rows to a private in-memory copy, so searches on the live index are never concurrent
+    # with add(); the live one may be mmapped, and faiss can't clone on-disk inverted lists
+    out = faiss.read_index(path)
+    _add(out, vecs, start, end)
+    return out
+
+def read(path: str) -> faiss.Index:
+    # IVF inverted lists are memory-mapped; HNSW graphs are loaded
+    return _filtered_ef(faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY))
+
+def filtered(index: faiss.Index, kind: str, fraction: float) -> dict:
+    # search settings widened for a filter that keeps `fraction` of the indexed rows
+    if kind not in ("ivf_flat", "ivf_pq"):
+        return {}  # flat scans every code anyway; HNSW gets its filtered efSearch in read()
+    return {"nprobe": min(int(math.ceil(ANN_NPROBE / max(fraction, 1e-6))), faiss.extract_index_ivf(index).nlist)}
+
+def _filtered_ef(index: faiss.Index) -> faiss.Index:
+    # faiss 1.7.4 ignores SearchParametersHNSW.efSearch when an ID selector is set and uses the
+    # index's own efSearch (default 16); size that for the sparsest filter still sent to HNSW
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = int(math.ceil(ANN_EF_SEARCH / max(ANN_FILTER_MIN, 1e-6)))
+    return index
+
+def params(kind: str, sel=None, nprobe: Optional[int] = None, ef: Optional[int] = None):
+    if kind == "hnsw":
+        p = faiss.SearchParametersHNSW()
+        p.efSearch = ef or ANN_EF_SEARCH
+    else:
+        p = faiss.SearchParametersIVF()
+        p.nprobe = 1 if kind == "flat" else (nprobe or ANN_NPROBE)
+    if sel is not None: p.sel = sel
+    return p
+
+def rescore(qv: np.ndarray, I: np.ndarray, vecs: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # exact inner products for the candidate rows only; pages in just those float32 vectors
+    D_out = np.full((len(qv), k), -np.inf, dtype="float32")
+    I_out = np.full((len(qv), k), -1, dtype="int64")
+    for q in range(len(qv)):
+        ids = np.unique(I[q][I[q] >= 0])
+        if not len(ids): continue
+        scores = np.asarray(vecs[ids], dtype="float32") @ qv[q]
+        top = np.argsort(-scores)[:k]
+        D_out[q, :len(top)], I_out[q, :len(top)] = scores[top], ids[top]
+    return D_out, I_out
+
+def bytes_per_vector(index: faiss.Index) -> float:
+    # serialized size covers codes, ids, graph links and quantizers
+    w = faiss.VectorIOWriter()
+    faiss.write_index(index, w)
+    return round(w.data.size() / max(index.ntotal, 1), 1)
+
+def recall_report(vecs: np.ndarray, n: int, kind: str, k: int = 10, n_queries: int = 200,
+                  settings: Optional[Iterable[int]] = None, codec: str = VECTOR_CODEC) -> Dict:
+    """
+    Build `kind` (stored with `codec`) over the first n stored vectors and compare it with exact
+    search: recall@k and mean per-query latency for each nprobe (IVF) / efSearch (HNSW) setting,
+    with and without exact re-scoring, plus index bytes per vector (float32 is 4*dim).
+    Queries are stored vectors with a little noise, so they are realistic but not exact hits.
+    """
+    rng = np.random.default_rng(1)
+    q = np.ascontiguousarray(vecs[np.sort(rng.choice(n, size=min(n_queries, n), replace=False))], dtype="float32")
+    q = q + rng.normal(scale=0.02, size=q.shape).astype("float32")
+    faiss.normalize_L2(q)
+    k = min(k, n)
+    t0 = time.perf_counter()
+    _, exact = faiss.knn(q, vecs[:n], k, faiss.METRIC_INNER_PRODUCT)
+    exact_ms = (time.perf_counter() - t0) * 1000 / len(q)
+    t0 = time.perf_counter()
+    index = build(kind, vecs, n, codec)
+    build_s = time.perf_counter() - t0
+    if settings is None:
+        settings = (1,) if kind == "flat" else (16, 32, 64, 128, 256) if kind == "hnsw" else (1, 4, 8, 16, 32, 64)
+    def recall(got):
+        return round(float(np.mean([len(set(a) & set(b)) / k for a, b in zip(got.tolist(), exact.tolist())])), 4)
+    rows = []
+    for s in settings:
+        p = params(kind, ef=s) if kind == "hnsw" else params(kind, nprobe=s)
+        t0 = time.perf_counter()
+        _, got = index.search(q, k, params=p)
+        ms = (time.perf_counter() - t0) * 1000 / len(q)
+        row = {("ef_search" if kind == "hnsw" else "nprobe"): s, "recall": recall(got), "ms_per_query": round(ms, 4)}
+        if is_lossy(kind, codec) and VECTOR_RERANK > 1:
+            t0 = time.perf_counter()
+            _, cand = index.search(q, k * VECTOR_RERANK, params=p)
+            _, got = rescore(q, cand, vecs, k)
+            row.update(recall_rescored=recall(got), ms_per_query_rescored=round((time.perf_counter() - t0) * 1000 / len(q), 4))
+        rows.append(row)
+    return {"kind": kind, "codec": codec, "vectors": n, "k": k, "queries": len(q), "build_seconds": round(build_s, 2),
+            "bytes_per_vector": bytes_per_vector(index), "float32_bytes_per_vector": 4 * vecs.shape[1],
+            "exact_ms_per_query": round(exact_ms, 4), "settings": rows}
@@ -0,0 +1,143 @@
+import os, time, sqlite3, hashlib, threading, logging
+from typing import Optional, Union
+
+log = logging.getLogger(__name__)
+
+# generated files (notes PDFs, calendars) served under /downloads. Names are content hashes, so
+# identical output is stored once; each file expires after its TTL and the least recently handed
+# out files go first once the directory is over its size cap.
+DOWNLOAD_DIR = os.getenv("DOWNLOAD_DIR", os.path.join(os.getcwd(), "downloads"))
+ARTIFACT_DB = os.getenv("ARTIFACT_DB", os.path.join(os.getcwd(), "data", "artifacts.sqlite"))
+ARTIFACT_TTL = float(os.getenv("ARTIFACT_TTL", str(7 * 86400)))   # seconds a file is kept
+ARTIFACT_MAX_MB = float(os.getenv("ARTIFACT_MAX_MB", "1024"))       # total size cap for DOWNLOAD_DIR
+ARTIFACT_SWEEP = float(os.getenv("ARTIFACT_SWEEP", "300"))          # seconds between sweeps
+INTERMEDIATE_TTL = 3600  # leftover temp/.html files older than this are removed
+
+os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+
+def content_name(data: Union[bytes, str], hint: str, ext: str) -> str:
+    if isinstance(data, str): data = data.encode("utf-8")
+    return f"{hint}-{hashlib.sha256(data).hexdigest()[:16]}.{ext}"
+
+class ArtifactStore:
+    """
+    Index of the files in `root` (SQLite, shared by workers): size, last hand-out time and expiry
+    per file. Files are added by atomic rename, so /downloads never serves a partial file.
+    """
+    def __init__(self, root: str, db_path: str, ttl: float, max_bytes: int, sweep_every: float):
+        self.root, self.ttl, self.max_bytes, self.sweep_every = root, ttl, max_bytes, sweep_every
+        self.evicted = self.expired = self.cleaned = 0
+        self._swept = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS artifacts (name TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                         "used REAL NOT NULL, expires REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS artifacts_used ON artifacts(used)")
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def _record(self, name: str, ttl: Optional[float]):
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO artifacts(name, size, used, expires) VALUES (?,?,?,?)",
+                             (name, os.path.getsize(self.path(name)), now, now + (self.ttl if ttl is None else ttl)))
+        self.maybe_sweep()
+
+    def put(self, name: str, data: Union[bytes, str], ttl: Optional[float] = None) -> str:
+        if isinstance(data, str): data = data.encode("utf-8")
+        if not self.touch(name, ttl):
+            tmp = self.path(f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self.path(name))
+            self._record(name, ttl)
+        return name
+
+    def commit(self, tmp_path: str, name: str, ttl: Optional[float] = None) -> str:
+        # move a finished file (e.g. a render's temp output) into the store
+        os.replace(tmp_path, self.path(name))
+        self._record(name, ttl)
+        return name
+
+    def touch(self, name: str, ttl: Optional[float] = None) -> bool:
+        # True if `name` is stored; it counts as used now and its TTL restarts
+        if not os.path.exists(self.path(name)): return False
+        now = time.time()
+        with self._lock:
+            cur = self._db.execute("UPDATE artifacts SET used=?, expires=? WHERE name=?",
+                                   (now, now + (self.ttl if ttl is None else ttl), name))
+            known = cur.rowcount > 0
+        if not known: self._record(name, ttl)  # file from before the index, or another worker's race
+        return True
+
+    def exists(self, name: str) -> bool:
+        return os.path.basename(name) == name and os.path.exists(self.path(name))
+
+    def _remove(self, names) -> int:
+        # rows are dropped for files that are gone (including ones another worker removed first);
+        # a file that can't be removed keeps its row and is retried next sweep
+        done = []
+        for name in names:
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                log.warning("artifact sweep: cannot remove %s: %s", name, e)
+                continue
+            done.append(name)
+        with self._lock:
+            self._db.executemany("DELETE FROM artifacts WHERE name=?", [(n,) for n in done])
+        return len(done)
+
+    def maybe_sweep(self):
+        if time.time() - self._swept >= self.sweep_every:
+            self.sweep()
+
+    def sweep(self):
+        """Drop expired files, then least recently used ones until under 90% of the cap."""
+        now = self._swept = time.time()
+        with self._lock:
+            known = {n for n, in self._db.execute("SELECT name FROM artifacts")}
+        # files the index doesn't know: leftover temp/intermediate files, and files written before
+        # the store existed (those are adopted with their mtime, so they age out like the rest)
+        # other workers sweep and rename into the same directory, so any entry can vanish between
+        # the listing and the stat/remove; such entries are skipped
+        for entry in os.scandir(self.root):
+            try:
+                if not entry.is_file() or entry.name in known: continue
+                st = entry.stat()
+                if entry.name.startswith(".") or entry.name.endswith((".tmp", ".html")):
+                    if now - st.st_mtime > INTERMEDIATE_TTL:
+                        os.remove(entry.path); self.cleaned += 1
+                    continue
+            except OSError:
+                continue
+            with self._lock:
+                self._db.execute("INSERT OR IGNORE INTO artifacts(name, size, used, expires) VALUES (?,?,?,?)",
+                                 (entry.name, st.st_size, st.st_mtime, st.st_mtime + self.ttl))
+        with self._lock:
+            gone = [n for n, in self._db.execute("SELECT name FROM artifacts WHERE expires<=?", (now,))]
+        self.expired += self._remove(gone)
+        with self._lock:
+            total, = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()
+            victims = []
+            if total > self.max_bytes:
+                for name, size in self._db.execute("SELECT name, size FROM artifacts ORDER BY used"):
+                    if total <= self.max_bytes * 0.9: break
+                    victims.append(name); total -= size
+        self.evicted += self._remove(victims)
+        if gone or victims:
+            log.info("artifact sweep: %d expired, %d evicted, %.1f MB kept", len(gone), len(victims), total / 2**20)
+
+    def stats(self) -> dict:
+        with self._lock:
+            n, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts").fetchone()
+        return {"files": n, "bytes": size, "max_bytes": self.max_bytes, "expired": self.expired,
+                "evicted": self.evicted, "intermediates_cleaned": self.cleaned}
+
+artifacts = ArtifactStore(DOWNLOAD_DIR, ARTIFACT_DB, ARTIFACT_TTL, int(ARTIFACT_MAX_MB * 1024 * 1024), ARTIFACT_SWEEP)
@@ -1,56 +1,138 @@
 from typing import List, Optional, Dict, Any
-import os
+import os, time, hashlib, threading, logging
+from collections import Counter
 from fastapi import Depends, HTTPException, Header
+import httpx
 import jwt
 from jwt import InvalidTokenError
 from pydantic import BaseModel
 
-from descope import DescopeClient
-# from descope.exceptions import DescopeException
-
+from .cache import TTLCache
 from .settings import settings
+from . import metrics
 
+log = logging.getLogger(__name__)
 
 PROJECT_ID = os.getenv("DESCOPE_PROJECT_ID")
 AUD = os.getenv("DESCOPE_AUD", "new-mcp")
 
-_client = DescopeClient(project_id=PROJECT_ID)
+# Descope session JWTs are verified locally against the project's published signing keys,
+# instead of a Descope call per request
+DESCOPE_BASE_URL = os.getenv("DESCOPE_BASE_URL", "https://api.descope.com")
+DESCOPE_JWKS_URL = os.getenv("DESCOPE_JWKS_URL", f"{DESCOPE_BASE_URL}/v2/keys/{PROJECT_ID}")
+JWKS_REFRESH = float(os.getenv("JWKS_REFRESH", "600"))           # seconds between key refreshes
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "4096"))      # verified tokens remembered; 0 disables
+AUTH_CACHE_MARGIN = float(os.getenv("AUTH_CACHE_MARGIN", "30"))  # forget a token this many seconds before exp
+AUTH_LEEWAY = float(os.getenv("AUTH_LEEWAY", "5"))               # clock skew allowed on exp/nbf/iat
+
+# running totals: verifications done, answered from cache, rejected, key fetches, time spent
+auth_stats: Counter = Counter()
+_stats_lock = threading.Lock()
 
-def _extract_claims(session_obj: Any) -> Dict[str, Any]:
+def _count(**kw):
+    with _stats_lock:
+        auth_stats.update(kw)
+
+class JWKS:
+    """
+    Signing keys by kid, fetched from `url` and refreshed every `refresh` seconds. A token with
+    an unknown kid (key rotation) forces an early refresh, at most once per `min_gap` seconds.
+    If a refresh fails, the keys already held stay in use.
     """
-    Different SDK versions return different shapes (dict with 'claims', or the claims directly).
-    Normalize to a dict of claims.
+    def __init__(self, url: str, refresh: float = JWKS_REFRESH, min_gap: float = 30.0):
+        self.url, self.refresh, self.min_gap = url, refresh, min_gap
+        self._keys: Dict[Optional[str], jwt.PyJWK] = {}
+        self._fetched = 0.0
+        self._lock = threading.Lock()
+
+    def _fetch(self):
+        with metrics.stage("jwks_fetch"):
+            r = httpx.get(self.url, timeout=10.0)
+        r.raise_for_status()
+        keys = {}
+        for jwk in r.json().get("keys", []):
+            try:
+                keys[jwk.get("kid")] = jwt.PyJWK(jwk)
+            except jwt.PyJWTError:
+                continue  # unsupported key type; skip it like the Descope SDK does
+        self._keys, self._fetched = keys, time.time()
+        _count(jwks_fetches=1)
+
+    def get(self, kid: Optional[str]) -> Optional[jwt.PyJWK]:
+        key = self._keys.get(kid)
+        if key is not None and time.time() - self._fetched < self.refresh:
+            return key
+        with self._lock:
+            now = time.time()
+            age = now - self._fetched
+            if age >= self.refresh or (kid not in self._keys and age >= self.min_gap):
+                try:
+                    self._fetch()
+                except Exception as e:
+                    if not self._keys: raise
+                    log.warning("JWKS refresh from %s failed, keeping current keys: %s", self.url, e)
+                    self._fetched = now - self.refresh + self.min_gap  # retry soon
+            return self._keys.get(kid)
+
+jwks = JWKS(DESCOPE_JWKS_URL)
+_verified = TTLCache(AUTH_CACHE_SIZE, 0)  # entries carry their own ttl
+
+def verify_session(token: str) -> Dict[str, Any]:
     """
-    if not session_obj:
-        return {}
-    if isinstance(session_obj, dict):
-        return session_obj.get("claims") or session_obj
-    # Fallback: try attribute access
-    return getattr(session_obj, "claims", {}) or {}
+    Check a session JWT's signature against the cached JWKS plus exp/nbf/iat and the issuer
+    (Descope issues either the project id or a URL ending in it). 'aud' is not enforced.
+    Returns the claims; raises InvalidTokenError.
+    """
+    kid = jwt.get_unverified_header(token).get("kid")
+    key = jwks.get(kid)
+    if key is None:
+        raise InvalidTokenError(f"unknown signing key {kid!r}")
+    claims = jwt.decode(token, key.key, algorithms=[key.algorithm_name], leeway=AUTH_LEEWAY,
+                        options={"verify_aud": False, "require": ["exp"]})
+    if PROJECT_ID and str(claims.get("iss", "")).rsplit("/", 1)[-1] != PROJECT_ID:
+        raise InvalidTokenError("Bad issuer")
+    return claims
 
 def require_user(authorization: Optional[str]) -> Dict[str, Any]:
     """
     Validate a Descope session token.
     Returns the normalized claims dict without enforcing 'aud'.
+    Successful validations are remembered per token until shortly before it expires.
     """
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing Authorization")
     
     token = authorization.split(" ", 1)[1].strip()
+    key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    hit = _verified.get(key)
+    if hit is not None:
+        _count(cache_hits=1)
+        return hit
 
+    t0 = time.perf_counter()
     try:
-        # Validate the session without audience check
-        session = _client.validate_session(token)
-        claims = _extract_claims(session)
-    except Exception as e:
+        with metrics.stage("auth_verify"):
+            claims = verify_session(token)
+    except InvalidTokenError as e:
+        _count(failures=1, verify_seconds=time.perf_counter() - t0)
         raise HTTPException(status_code=401, detail=f"Invalid token: {e}")
+    except Exception as e:
+        # keys could not be fetched at all; not the caller's fault
+        _count(failures=1, verify_seconds=time.perf_counter() - t0)
+        log.exception("token verification unavailable")
+        raise HTTPException(status_code=503, detail=f"Token verification unavailable: {e}")
+    _count(verifications=1, verify_seconds=time.perf_counter() - t0)
 
     # Ensure subject exists
     sub = claims.get("sub") or claims.get("subject")
     if not sub:
         raise HTTPException(status_code=401, detail="Token missing 'sub'")
 
-    return {"claims": claims, "subject": sub}
+    session = {"claims": claims, "subject": sub}
+    ttl = float(claims["exp"]) - time.time() - AUTH_CACHE_MARGIN
+    if ttl > 0:
+        _verified.put(key, session, ttl=ttl)
+    return session
 
 class Principal(BaseModel):
     sub: str
@@ -0,0 +1,76 @@
+import os, time, sqlite3, threading
+from collections import OrderedDict
+from typing import Any, Optional, Hashable
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with a per-entry TTL. maxsize <= 0 turns it into a no-op.
+    With `path`, entries (str values only) also go to SQLite so they survive restarts and
+    are shared between workers; the in-process dict stays in front as the hot tier.
+    """
+    def __init__(self, maxsize: int, ttl: float, path: Optional[str] = None):
+        self.maxsize, self.ttl = maxsize, ttl
+        self.hits = self.misses = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path and maxsize > 0:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                             "expires REAL NOT NULL, used REAL NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries(used)")
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if self.maxsize <= 0: return None
+        now = time.time()
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is not None and hit[1] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return hit[0]
+            if hit is not None:
+                del self._data[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT value, expires FROM entries WHERE key=? AND expires>?",
+                                       (str(key), now)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE entries SET used=? WHERE key=?", (now, str(key)))
+                    self._remember(key, row[0], row[1])
+                    self.hits += 1
+                    return row[0]
+            self.misses += 1
+        return None
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if self.maxsize <= 0: return
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remember(key, value, expires)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO entries(key, value, expires, used) VALUES (?,?,?,?)",
+                                 (str(key), value, expires, now))
+                self._db.execute("DELETE FROM entries WHERE expires<=?", (now,))
+                n, = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()
+                if n > self.maxsize:
+                    self._db.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY used LIMIT ?)",
+                                     (n - self.maxsize,))
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM entries WHERE key=?", (str(key),))
+
+    def _remember(self, key: Hashable, value: Any, expires: float):
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._data), "hits": self.hits, "misses": self.misses, "maxsize": self.maxsize}
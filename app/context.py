@@ -0,0 +1,112 @@
+import os, logging, threading
+from collections import Counter
+from typing import List, Dict, Optional
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# token budgets for the snippet block of each prompt
+QA_CONTEXT_TOKENS = int(os.getenv("QA_CONTEXT_TOKENS", "1200"))
+NOTES_CONTEXT_TOKENS = int(os.getenv("NOTES_CONTEXT_TOKENS", "5000"))
+QUIZ_CONTEXT_TOKENS = int(os.getenv("QUIZ_CONTEXT_TOKENS", "5000"))
+MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))       # relevance vs. novelty
+DUP_THRESHOLD = float(os.getenv("CONTEXT_DUP_THRESHOLD", "0.95"))  # cosine above this = near-duplicate
+
+try:
+    import tiktoken
+    _enc = tiktoken.encoding_for_model(os.getenv("LLM_MODEL", "gpt-4o-mini"))
+except Exception:  # not installed, or no BPE files offline
+    _enc = None
+
+def count_tokens(text: str) -> int:
+    # exact with tiktoken, otherwise the usual ~4 chars/token estimate
+    return len(_enc.encode(text)) if _enc is not None else (len(text) + 3) // 4
+
+# running totals: raw = what the snippets would have cost unpacked, packed = what was sent
+token_stats: Counter = Counter()
+_stats_lock = threading.Lock()
+
+def record_prompt(kind: str, raw_tokens: int, packed_tokens: int, prompt_tokens: int):
+    with _stats_lock:
+        token_stats[f"{kind}_calls"] += 1
+        token_stats[f"{kind}_context_raw"] += raw_tokens
+        token_stats[f"{kind}_context_packed"] += packed_tokens
+        token_stats[f"{kind}_prompt"] += prompt_tokens
+    log.info("%s prompt: %d tokens (context %d, %d before packing)", kind, prompt_tokens, packed_tokens, raw_tokens)
+
+def _merge_overlap(a: str, b: str, max_words: int = 200) -> Optional[str]:
+    # split_text repeats the tail of chunk j at the head of chunk j+1; stitch them back together
+    aw, bw = a.split(), b.split()
+    for k in range(min(max_words, len(aw), len(bw)), 0, -1):
+        if aw[-k:] == bw[:k]:
+            return " ".join(aw + bw[k:])
+    return None
+
+def _merge_adjacent(snippets: List[Dict]) -> List[Dict]:
+    out: List[Dict] = []
+    for s in sorted(snippets, key=lambda s: (int(s["source_id"]), s.get("ord", 0))):
+        prev = out[-1] if out else None
+        if prev is not None and "ord" in s and prev["source_id"] == s["source_id"] and prev["ord"] + 1 == s["ord"]:
+            merged = _merge_overlap(prev["text"], s["text"])
+            if merged is not None:
+                prev["text"], prev["ord"] = merged, s["ord"]
+                prev["score"] = max(prev.get("score", 0.0), s.get("score", 0.0))
+                if prev.get("vec") is not None and s.get("vec") is not None:
+                    v = prev["vec"] + s["vec"]
+                    prev["vec"] = v / (np.linalg.norm(v) or 1.0)
+                continue
+        out.append(s)
+    return out
+
+def pack_context(snippets: List[Dict], budget: int, keep_source_order: bool = False) -> List[Dict]:
+    """
+    Fill `budget` tokens from snippets ({source_id, text, [ord, score, vec]}):
+    adjacent overlapping chunks of a source are merged, then chunks are picked by MMR
+    (score vs. similarity to what is already picked) and near-duplicates are dropped.
+    Without scores, input order is the priority. The last pick is truncated to fit; the
+    total never exceeds `budget`.
+    """
+    if not snippets: return []
+    n = len(snippets)
+    cands = _merge_adjacent([dict(s, score=s.get("score", 1.0 - i / n)) for i, s in enumerate(snippets)])
+    # exact-text duplicates first (cheap, and covers snippets without vectors)
+    seen, uniq = set(), []
+    for c in cands:
+        if c["text"] not in seen:
+            seen.add(c["text"]); uniq.append(c)
+    cands = uniq
+    have_vecs = all(c.get("vec") is not None for c in cands)
+    V = np.stack([c["vec"] for c in cands]).astype("float32") if have_vecs else None
+    rel = np.array([c["score"] for c in cands], dtype="float32")
+    max_sim = np.full(len(cands), -1.0, dtype="float32")
+    left = np.ones(len(cands), dtype=bool)
+    picked, used = [], 0
+    while left.any() and used < budget:
+        if V is not None:
+            mmr = MMR_LAMBDA * rel - (1 - MMR_LAMBDA) * np.maximum(max_sim, 0)
+        else:
+            mmr = rel.copy()
+        mmr[~left] = -np.inf
+        i = int(np.argmax(mmr))
+        left[i] = False
+        if V is not None:
+            if max_sim[i] >= DUP_THRESHOLD: continue
+            max_sim = np.maximum(max_sim, V @ V[i])
+        c = cands[i]
+        t = count_tokens(c["text"])
+        if used + t > budget:
+            room = budget - used
+            if room < 32: continue  # not worth a fragment; a shorter chunk may still fit
+            # shrink in proportion to the overshoot until it fits: chars per token vary (code,
+            # numbers and non-Latin text run well under 4), so one cut can't be trusted
+            text = c["text"]
+            while t > room and text:
+                cut = text[:max(len(text) * room // t - 1, 0)]
+                text = cut.rsplit(" ", 1)[0] if " " in cut else cut
+                t = count_tokens(text) if text else 0
+            if not text.strip(): continue
+            c = dict(c, text=text)
+        picked.append(c); used += t
+    if keep_source_order:
+        picked.sort(key=lambda s: (int(s["source_id"]), s.get("ord", 0)))
+    return [{"source_id": s["source_id"], "text": s["text"]} for s in picked]
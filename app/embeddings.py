@@ -1,16 +1,190 @@
-import os, numpy as np
-from typing import List
+import os, time, queue, sqlite3, hashlib, threading, numpy as np
+from concurrent.futures import Future
+from typing import List, Dict, Optional, Tuple
 from sentence_transformers import SentenceTransformer
+from .cache import TTLCache
+from . import metrics
+
+MODEL_NAME = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", os.path.join(os.getcwd(), "data", "embed_cache"))
+EMBED_CACHE_MB = float(os.getenv("EMBED_CACHE_MB", "512"))  # 0 disables the cache
+# search queries from concurrent requests share one forward pass
+EMBED_QUERY_BATCH = int(os.getenv("EMBED_QUERY_BATCH", "32"))        # max queries per pass
+EMBED_QUERY_WAIT_MS = float(os.getenv("EMBED_QUERY_WAIT_MS", "3"))   # longest a query waits for company; 0 = off
+EMBED_QUERY_CACHE = int(os.getenv("EMBED_QUERY_CACHE", "2048"))      # recent query vectors kept in memory
 
 _model = None
 def get_model():
     global _model
     if _model is None:
-        name = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
-        _model = SentenceTransformer(name)
+        _model = SentenceTransformer(MODEL_NAME)
     return _model
 
-def embed_texts(texts: List[str]) -> np.ndarray:
+class EmbeddingCache:
+    """
+    Content-addressed vector cache: sha256(model + text) -> float32 bytes, in SQLite (WAL, so
+    several workers can share it). Least-recently-used rows are evicted past max_bytes.
+    """
+    def __init__(self, path: str, max_bytes: int):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS vecs (key BLOB PRIMARY KEY, vec BLOB NOT NULL, used REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS vecs_used ON vecs(used)")
+        # row count kept as rows are inserted, so puts don't COUNT(*) the table; it is re-read
+        # after every ~10% of the cap inserted here, since other workers insert too
+        self._rows, = self._db.execute("SELECT COUNT(*) FROM vecs").fetchone()
+        self._since_count = 0
+
+    @staticmethod
+    def key(model: str, text: str) -> bytes:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).digest()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        out: Dict[bytes, np.ndarray] = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):  # stay under SQLite's host-parameter limit
+                part = keys[i:i+500]
+                q = f"SELECT key, vec FROM vecs WHERE key IN ({','.join('?'*len(part))})"
+                for k, v in self._db.execute(q, part):
+                    out[k] = np.frombuffer(v, dtype="float32")
+            if out:
+                now = time.time()
+                self._db.executemany("UPDATE vecs SET used=? WHERE key=?", [(now, k) for k in out])
+            self.hits += len(out)
+            self.misses += len(set(keys)) - len(out)
+        return out
+
+    def put_many(self, items: Dict[bytes, np.ndarray]):
+        if not items: return
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            # a key's vector never changes, so a row another worker already wrote is kept as is
+            added = self._db.executemany("INSERT OR IGNORE INTO vecs(key, vec, used) VALUES (?,?,?)",
+                                         [(k, v.astype("float32").tobytes(), now) for k, v in items.items()]).rowcount
+            self._db.execute("COMMIT")
+            self._evict(next(iter(items.values())).size * 4, max(added, 0))
+
+    def _evict(self, vec_bytes: int, added: int):
+        # every row holds one vector of the same model, so count * row size is the payload
+        row_bytes = vec_bytes + 32
+        max_rows = self.max_bytes // row_bytes
+        self._rows += added; self._since_count += added
+        if self._rows <= max_rows and self._since_count < max(max_rows // 10, 1): return
+        self._rows, = self._db.execute("SELECT COUNT(*) FROM vecs").fetchone()
+        self._since_count = 0
+        if self._rows <= max_rows: return
+        # evict down to 90% so we don't pay for this on every insert
+        drop = self._rows - int(max_rows * 0.9)
+        self._rows -= self._db.execute("DELETE FROM vecs WHERE key IN (SELECT key FROM vecs ORDER BY used LIMIT ?)", (drop,)).rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            n, = self._db.execute("SELECT COUNT(*) FROM vecs").fetchone()
+        return {"entries": n, "hits": self.hits, "misses": self.misses, "max_bytes": self.max_bytes}
+
+_cache: Optional[EmbeddingCache] = None
+if EMBED_CACHE_MB > 0:
+    _cache = EmbeddingCache(os.path.join(EMBED_CACHE_DIR, "vectors.sqlite"), int(EMBED_CACHE_MB * 1024 * 1024))
+
+def _encode(texts: List[str]) -> np.ndarray:
     m = get_model()
-    v = m.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+    with metrics.stage("embed"):
+        v = m.encode(texts, normalize_embeddings=True, convert_to_numpy=True)
+    metrics.inc("texts_embedded", len(texts))
     return v.astype("float32")
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    if _cache is None or not texts:
+        return _encode(texts)
+    keys = [EmbeddingCache.key(MODEL_NAME, t) for t in texts]
+    found = _cache.get_many(keys)
+    # only cache misses go to the model; duplicate texts in one batch are encoded once
+    missing: Dict[bytes, str] = {}
+    for k, t in zip(keys, texts):
+        if k not in found: missing.setdefault(k, t)
+    if missing:
+        vecs = _encode(list(missing.values()))
+        fresh = dict(zip(missing.keys(), vecs))
+        _cache.put_many(fresh)
+        found.update(fresh)
+    return np.stack([found[k] for k in keys]).astype("float32", copy=False)
+
+class QueryBatcher:
+    """
+    Coalesces single-query embeds from concurrent requests: the first query into an empty queue
+    waits at most `wait_ms` for others, and a batch goes out as soon as it holds `max_batch`.
+    One background thread runs the batches, so callers just block on their own result.
+    """
+    def __init__(self, max_batch: int = EMBED_QUERY_BATCH, wait_ms: float = EMBED_QUERY_WAIT_MS):
+        self.max_batch, self.wait = max(max_batch, 1), wait_ms / 1000
+        self.batches = self.queries = 0
+        self._q: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, text: str) -> Future:
+        fut: Future = Future()
+        self._q.put((text, fut))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="query-embed", daemon=True)
+                    self._thread.start()
+        return fut
+
+    def _run(self):
+        while True:
+            items = [self._q.get()]
+            deadline = time.monotonic() + self.wait
+            while len(items) < self.max_batch:
+                left = deadline - time.monotonic()
+                try:
+                    items.append(self._q.get(timeout=left) if left > 0 else self._q.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                vecs = _encode([t for t, _ in items])
+            except Exception as e:
+                for _, f in items: f.set_exception(e)
+                continue
+            for (_, f), v in zip(items, vecs): f.set_result(v)
+            self.batches += 1
+            self.queries += len(items)
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "queries": self.queries,
+                "mean_batch": round(self.queries / self.batches, 2) if self.batches else 0.0}
+
+_batcher = QueryBatcher()
+_query_cache = TTLCache(EMBED_QUERY_CACHE, float("inf"))
+
+def embedding_stats() -> dict:
+    return {"cache": _cache.stats() if _cache is not None else None, "query_cache": _query_cache.stats(),
+            "batcher": _batcher.stats()}
+
+# query vectors stay in process memory (_query_cache); the persistent cache is for chunk text,
+# which is worth keeping across restarts, not for one-off questions
+def embed_query(text: str) -> np.ndarray:
+    # (1, dim) vector for a search query: recent queries come from memory, the rest are batched
+    v = _query_cache.get(text)
+    if v is None:
+        with metrics.stage("embed_query"):  # includes the wait for batch company
+            v = _encode([text])[0] if EMBED_QUERY_WAIT_MS <= 0 else _batcher.submit(text).result()
+        _query_cache.put(text, v)
+    return v[None, :]
+
+def embed_queries(texts: List[str]) -> np.ndarray:
+    # (n, dim) vectors for several queries at once: one pass for the ones not in memory
+    found = {t: _query_cache.get(t) for t in set(texts)}
+    missing = [t for t in dict.fromkeys(texts) if found[t] is None]
+    if missing:
+        with metrics.stage("embed_query"):
+            for t, v in zip(missing, _encode(missing)):
+                _query_cache.put(t, v); found[t] = v
+    return np.stack([found[t] for t in texts])
@@ -1,8 +1,23 @@
-from typing import List, Tuple
+import os, re, json, time, hashlib, zipfile, posixpath
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+import multiprocessing as mp
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Tuple, Iterator, Iterable, Callable, Optional
+import numpy as np
 import fitz  # PyMuPDF
-from pptx import Presentation
-from docx import Document
 from dataclasses import dataclass
+from functools import lru_cache
+from . import metrics
+
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXTRACT_BLOCK = int(os.getenv("EXTRACT_BLOCK", "16"))    # pages/slides per extraction task
+EMBED_BATCH = int(os.getenv("EMBED_BATCH", "64"))        # chunks per embedding batch
+INGEST_MEM_MB = float(os.getenv("INGEST_MEM_MB", "64"))  # page text held in flight per ingestion
+CHUNK_CHARS = int(os.getenv("CHUNK_CHARS", "800"))       # max chunk length in characters
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "80"))    # words repeated at the start of the next chunk
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", "0"))       # >0: size chunks in embedding-model tokens instead
 
 @dataclass
 class Chunk:
@@ -10,55 +25,321 @@ class Chunk:
     source_id: str  # page/slide number as string
     text: str
 
-def extract_pdf_pages(path: str, start: int, end: int) -> List[Tuple[int,str]]:
-    doc = fitz.open(path); n = doc.page_count
-    start, end = max(1,start), min(end,n)
+# extractors are generators over the requested range only: nothing past `end` is parsed, and
+# pptx/docx are read straight from the zip instead of loading the whole document model
+
+def extract_pdf_pages(path: str, start: int, end: int) -> Iterator[Tuple[int,str]]:
+    with fitz.open(path) as doc:
+        n = doc.page_count
+        for i in range(max(1,start)-1, min(end,n)):
+            page = doc.load_page(i)
+            yield i+1, (page.get_text("text") or "").strip()
+
+_NS_P = "{http://schemas.openxmlformats.org/presentationml/2006/main}"
+_NS_A = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+_NS_R = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_NS_REL = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+def _pptx_slide_parts(z: zipfile.ZipFile) -> List[str]:
+    # slide part names in presentation order (sldIdLst -> relationship targets)
+    rels = ET.fromstring(z.read("ppt/_rels/presentation.xml.rels"))
+    target = {r.get("Id"): r.get("Target") for r in rels.iter(f"{_NS_REL}Relationship")}
+    pres = ET.fromstring(z.read("ppt/presentation.xml"))
     out = []
-    for i in range(start-1, end):
-        page = doc.load_page(i)
-        out.append((i+1, (page.get_text("text") or "").strip()))
+    for sid in pres.iter(f"{_NS_P}sldId"):
+        t = target[sid.get(f"{_NS_R}id")]
+        out.append(t.lstrip("/") if t.startswith("/") else posixpath.normpath(posixpath.join("ppt", t)))
     return out
 
-def extract_pptx_slides(path: str, start: int, end: int) -> List[Tuple[int,str]]:
-    prs = Presentation(path); n = len(prs.slides)
-    start, end = max(1,start), min(end,n)
-    out=[]
-    for i in range(start-1, end):
-        slide = prs.slides[i]
-        texts=[]
-        for sh in slide.shapes:
-            if hasattr(sh, "text") and sh.text:
-                texts.append(sh.text.strip())
-        out.append((i+1, "\n".join(t for t in texts if t)))
-    return out
+def _pptx_shape_text(sp) -> str:
+    # what python-pptx's shape.text gives: paragraphs joined by newlines, line breaks as \v
+    body = sp.find(f"{_NS_P}txBody")
+    if body is None: return ""
+    paras = []
+    for para in body.findall(f"{_NS_A}p"):
+        parts = []
+        for el in para:
+            if el.tag in (f"{_NS_A}r", f"{_NS_A}fld"):
+                parts.append(el.findtext(f"{_NS_A}t") or "")
+            elif el.tag == f"{_NS_A}br":
+                parts.append("\v")
+        paras.append("".join(parts))
+    return "\n".join(paras)
 
-def extract_docx_pages(path: str, start: int, end: int) -> List[Tuple[int,str]]:
-    paras = [p.text.strip() for p in Document(path).paragraphs if p.text and p.text.strip()]
-    if not paras: return []
-    buckets, buf=[], ""
-    for p in paras:
-        if len(buf)+len(p)+1 > 3000:
-            buckets.append(buf); buf = p
-        else:
-            buf = f"{buf}\n{p}" if buf else p
-    if buf: buckets.append(buf)
-    n = len(buckets); start, end = max(1,start), min(end,n)
-    return [(i+1, buckets[i]) for i in range(start-1, end)]
-
-def split_text(text: str, max_len=800, overlap=80) -> List[str]:
-    if not text: return []
-    words=text.split(); out=[]; cur=[]
-    for w in words:
-        cur.append(w)
-        if sum(len(x)+1 for x in cur) > max_len:
-            out.append(" ".join(cur[:-1]))
-            cur = cur[-overlap:] if overlap < len(cur) else cur
-    if cur: out.append(" ".join(cur))
+def extract_pptx_slides(path: str, start: int, end: int) -> Iterator[Tuple[int,str]]:
+    with zipfile.ZipFile(path) as z:
+        parts = _pptx_slide_parts(z)
+        for i in range(max(1,start)-1, min(end,len(parts))):
+            tree = ET.fromstring(z.read(parts[i])).find(f"{_NS_P}cSld/{_NS_P}spTree")
+            texts = []
+            # top-level text shapes only, as before (groups, tables and pictures carry no .text)
+            for sh in (tree if tree is not None else []):
+                if sh.tag == f"{_NS_P}sp":
+                    t = _pptx_shape_text(sh).strip()
+                    if t: texts.append(t)
+            yield i+1, "\n".join(texts)
+
+# docx has no pages; paragraphs are packed into DOCX_PAGE_CHARS buckets in document order.
+# Where each bucket starts in word/document.xml is remembered per file content, so a later
+# range skips straight to its first page instead of re-parsing everything before it.
+DOCX_PAGE_CHARS = 3000
+DOCX_INDEX_DIR = os.getenv("DOCX_INDEX_DIR", os.path.join(os.getcwd(), "data", "docx_index"))
+_W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main "
+_W_P, _W_R, _W_T, _W_HL, _W_BR = _W + "p", _W + "r", _W + "t", _W + "hyperlink", _W + "br"
+_W_RUN_TEXT = {_W + "tab": "\t", _W + "ptab": "\t", _W + "cr": "\n", _W + "noBreakHyphen": "-"}
+
+def _file_hash(path: str) -> str:
+    # the content hash is read once per file version: memoized on (path, size, mtime)
+    st = os.stat(path)
+    return _hash_file(os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+@lru_cache(maxsize=256)
+def _hash_file(path: str, size: int, mtime_ns: int) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _docx_paragraphs(blocks: Iterable[bytes], base: int = 0) -> Iterator[Tuple[int,str]]:
+    """
+    (byte offset, text) of each body-level paragraph, streamed through expat. Text follows
+    python-docx's Paragraph.text: runs directly in the paragraph or in hyperlinks.
+    Offsets are parser positions + base. The first item is (offset of the first body element, None).
+    """
+    parser = expat.ParserCreate(namespace_separator=" ")
+    stack: List[str] = []
+    out: List[Tuple[int, Optional[str]]] = []
+    para: List[str] = []
+    st = {"p": -1, "t": False, "first": True}
+    def in_run() -> bool:
+        # document > body > p > r, or document > body > p > hyperlink > r
+        return (len(stack) == 4 and stack[3] == _W_R) or (len(stack) == 5 and stack[3] == _W_HL and stack[4] == _W_R)
+    def start(name, attrs):
+        if len(stack) == 2 and st["first"]:
+            out.append((base + parser.CurrentByteIndex, None)); st["first"] = False
+        if len(stack) == 2 and name == _W_P:
+            st["p"] = base + parser.CurrentByteIndex; para.clear()
+        elif st["p"] >= 0 and in_run():
+            if name == _W_T: st["t"] = True
+            elif name == _W_BR: para.append("\n" if attrs.get(_W + "type", "textWrapping") == "textWrapping" else "")
+            elif name in _W_RUN_TEXT: para.append(_W_RUN_TEXT[name])
+        stack.append(name)
+    def end(name):
+        stack.pop()
+        if name == _W_T: st["t"] = False
+        elif len(stack) == 2 and name == _W_P:
+            out.append((st["p"], "".join(para))); st["p"] = -1
+    def chars(data):
+        if st["t"]: para.append(data)
+    parser.StartElementHandler, parser.EndElementHandler, parser.CharacterDataHandler = start, end, chars
+    for block in blocks:
+        parser.Parse(block, False)
+        yield from out
+        out.clear()
+
+def _docx_index(key: str) -> Dict:
+    try:
+        with open(os.path.join(DOCX_INDEX_DIR, f"{key}.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"header": None, "pages": [], "total": None}
+
+def _save_docx_index(key: str, idx: Dict):
+    os.makedirs(DOCX_INDEX_DIR, exist_ok=True)
+    path = os.path.join(DOCX_INDEX_DIR, f"{key}.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(idx, f)
+    os.replace(path + ".tmp", path)
+
+def extract_docx_pages(path: str, start: int, end: int) -> Iterator[Tuple[int,str]]:
+    key = _file_hash(path)
+    idx = _docx_index(key)
+    known = len(idx["pages"])  # pages[k] = byte offset of page k+1's first paragraph
+    if idx["total"] is not None and start > idx["total"]: return
+    resume = min(max(start, 1), known)  # 0 = parse from the top
+    learned = False
+    with zipfile.ZipFile(path) as z, z.open("word/document.xml") as f:
+        def blocks():
+            if resume:
+                # the document prolog (namespaces, <w:body>) followed by the bytes from the page's offset
+                head, skip = f.read(idx["header"]), idx["pages"][resume - 1] - idx["header"]
+                while skip > 0:
+                    skip -= len(f.read(min(skip, 1 << 20)))
+                yield head
+            yield from iter(lambda: f.read(1 << 16), b"")
+        base = idx["pages"][resume - 1] - idx["header"] if resume else 0
+        page, buf = max(resume, 1), ""
+        try:
+            for off, text in _docx_paragraphs(blocks(), base):
+                if text is None:
+                    if not resume and idx["header"] is None: idx["header"] = off
+                    continue
+                t = text.strip()
+                if not t: continue
+                if not buf and page > known:
+                    idx["pages"].append(off); known += 1; learned = True
+                if len(buf) + len(t) + 1 > DOCX_PAGE_CHARS:
+                    if page >= start: yield page, buf
+                    if page >= end: return
+                    page += 1
+                    if page > known:
+                        idx["pages"].append(off); known += 1; learned = True
+                    buf = t
+                else:
+                    buf = f"{buf}\n{t}" if buf else t
+            if buf:
+                if page >= start: yield page, buf
+            elif page == 1:
+                page = 0  # no text at all
+            if idx["total"] is None:
+                idx["total"], learned = page, True
+        finally:
+            if learned: _save_docx_index(key, idx)
+
+_WORD = re.compile(r"\S+")
+
+def _windows(starts: np.ndarray, ends: np.ndarray, cost: np.ndarray, budget: int, overlap: int) -> List[Tuple[int,int]]:
+    # greedy word windows whose cost stays within budget; each window starts `overlap` words
+    # before the previous one ended. prefix sums + a forward-only search keep it linear
+    n = len(starts)
+    csum = np.concatenate(([0], np.cumsum(cost)))
+    out, i, last = [], 0, 0
+    while i < n:
+        # furthest j with cost of words [i, j) <= budget, at least one word
+        j = max(int(np.searchsorted(csum, csum[i] + budget, "right")) - 1, i + 1)
+        if j <= last:
+            i = last  # the overlap leaves no room for new words; start fresh instead
+            continue
+        out.append((int(starts[i]), int(ends[j - 1])))
+        if j >= n: break
+        last, i = j, max(j - overlap, i + 1)
     return out
 
+def chunk_spans(text: str, max_len: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP,
+                max_tokens: int = 0) -> List[Tuple[int,int]]:
+    """
+    (start, end) offsets of chunks of `text`, cut at whitespace: at most max_len characters,
+    or at most max_tokens tokens of the embedding model's tokenizer when max_tokens > 0.
+    A single word over the limit becomes its own chunk.
+    """
+    spans = [(m.start(), m.end()) for m in _WORD.finditer(text)]
+    if not spans: return []
+    starts, ends = np.array(spans, dtype="int64").T
+    if max_tokens > 0:
+        from .embeddings import get_model
+        offsets = get_model().tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        # tokens per word: count token starts falling in each word's span
+        tok_starts = np.array([a for a, _ in offsets], dtype="int64")
+        cost = np.diff(np.searchsorted(tok_starts, np.append(starts, len(text)), "left"))
+        return _windows(starts, ends, cost, max_tokens, overlap)
+    # cost of a word = the word plus the whitespace before it, so a window's summed cost is its
+    # slice length plus the gap before its first word (windows err short by that gap)
+    cost = np.concatenate(([ends[0] - starts[0]], ends[1:] - ends[:-1]))
+    return _windows(starts, ends, cost, max_len, overlap)
+
+def split_text(text: str, max_len=CHUNK_CHARS, overlap=CHUNK_OVERLAP, max_tokens: int = 0) -> List[str]:
+    return [text[a:b] for a, b in chunk_spans(text, max_len, overlap, max_tokens)]
+
 def make_chunks(kind: str, items: List[Tuple[int,str]], corpus_id: str) -> List[Chunk]:
     chunks=[]
     for source_num, raw in items:
-        for j, t in enumerate(split_text(raw, 800, 80)):
+        for j, t in enumerate(split_text(raw, CHUNK_CHARS, CHUNK_OVERLAP, CHUNK_TOKENS)):
             chunks.append(Chunk(uid=f"{corpus_id}:{source_num}:{j}", source_id=str(source_num), text=t))
     return chunks
+
+
+EXTRACTORS = {"pdf": extract_pdf_pages, "pptx": extract_pptx_slides, "docx": extract_docx_pages}
+
+def page_count(ftype: str, path: str) -> Optional[int]:
+    # pages/slides in the document; None for a docx whose end has not been reached yet
+    if ftype == "pdf":
+        with fitz.open(path) as doc:
+            return doc.page_count
+    if ftype == "pptx":
+        with zipfile.ZipFile(path) as z:
+            return len(_pptx_slide_parts(z))
+    return _docx_index(_file_hash(path))["total"]
+
+def _extract_block(ftype: str, path: str, a: int, b: int) -> List[Tuple[int,str]]:
+    return list(EXTRACTORS[ftype](path, a, b))
+
+_pool = None
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: the parent has torch/faiss thread pools that don't survive a fork
+        _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=mp.get_context("spawn"))
+    return _pool
+
+def iter_pages(ftype: str, path: str, start: int, end: int) -> Iterator[Tuple[int,str]]:
+    """
+    Yield (page, text) for start..end in order, extracting EXTRACT_BLOCK-page blocks in a
+    process pool. Blocks in flight are capped by worker count and INGEST_MEM_MB.
+    """
+    # a docx page depends on every paragraph before it, so docx is extracted serially
+    # (its page-boundary index makes ranges after the first one cheap)
+    if ftype == "docx" or EXTRACT_WORKERS <= 1 or end - start + 1 <= EXTRACT_BLOCK:
+        yield from EXTRACTORS[ftype](path, start, end)
+        return
+    pool = get_pool()
+    blocks = ((a, min(a + EXTRACT_BLOCK - 1, end)) for a in range(start, end + 1, EXTRACT_BLOCK))
+    window: deque = deque()
+    budget, page_bytes, seen = INGEST_MEM_MB * 1024 * 1024, 0, 0
+    def fill():
+        while len(window) < 2 * EXTRACT_WORKERS:
+            # estimate from pages seen so far; always keep at least one block going
+            if window and seen and page_bytes / seen * EXTRACT_BLOCK * len(window) > budget:
+                return
+            blk = next(blocks, None)
+            if blk is None: return
+            window.append((blk, pool.submit(_extract_block, ftype, path, *blk)))
+    fill()
+    while window:
+        (a, b), fut = window.popleft()
+        items = fut.result()
+        seen += len(items); page_bytes += sum(len(t) for _, t in items)
+        if len(items) < b - a + 1:
+            # ran past the end of the document
+            for _, f in window: f.cancel()
+            window.clear()
+        else:
+            fill()
+        yield from items
+
+def iter_chunk_batches(kind: str, pages: Iterable[Tuple[int,str]], corpus_id: str,
+                       batch: int = EMBED_BATCH) -> Iterator[Tuple[List[int], List[Chunk]]]:
+    # group whole pages into ~batch-sized chunk batches, so each batch can be indexed on its own
+    sources, chunks, nbytes = [], [], 0
+    budget = INGEST_MEM_MB * 1024 * 1024
+    for n, raw in pages:
+        sources.append(n)
+        with metrics.stage("chunk"):
+            page_chunks = make_chunks(kind, [(n, raw)], corpus_id)
+        chunks.extend(page_chunks)
+        nbytes += sum(len(c.text) for c in page_chunks)
+        if len(chunks) >= batch or nbytes >= budget:
+            yield sources, chunks
+            sources, chunks, nbytes = [], [], 0
+    if sources:
+        yield sources, chunks
+
+def ingest(ftype: str, kind: str, path: str, runs: List[Tuple[int,int]], corpus_id: str,
+           sink: Callable[[List[int], List[Chunk]], None]) -> dict:
+    """
+    Stream pages of each (start, end) run through extraction -> chunking -> sink(sources, chunks),
+    where the sink embeds and indexes one batch while the pool extracts the next pages.
+    """
+    t0 = time.perf_counter()
+    pages = chunks = 0
+    for a, b in runs:
+        # extraction time is the wait for each page (done in the pool when it is wider than a block)
+        for srcs, chs in iter_chunk_batches(kind, metrics.timed(iter_pages(ftype, path, a, b), "extract", type=ftype), corpus_id):
+            with metrics.stage("index"):
+                sink(srcs, chs)
+            pages += len(srcs); chunks += len(chs)
+    secs = time.perf_counter() - t0
+    metrics.inc("pages_ingested", pages, type=ftype)
+    metrics.inc("chunks_ingested", chunks, type=ftype)
+    return {"pages": pages, "chunks": chunks, "seconds": round(secs, 3),
+            "pages_per_sec": round(pages / secs, 2) if pages and secs else 0.0}
@@ -0,0 +1,86 @@
+import os, time, uuid, asyncio, threading, contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Any
+
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "2"))  # ingestions running at once
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "256"))              # finished jobs kept for status checks
+
+@dataclass
+class Job:
+    job_id: str
+    owner: str
+    corpus_id: str
+    pages_total: int
+    state: str = "queued"  # "queued" | "running" | "done" | "failed"
+    pages_extracted: int = 0
+    chunks_embedded: int = 0
+    submitted: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+
+    def progress(self, pages: int, chunks: int):
+        self.pages_extracted += pages
+        self.chunks_embedded += chunks
+
+    def eta_seconds(self) -> Optional[float]:
+        if self.state != "running" or not self.pages_extracted or not self.started:
+            return 0.0 if self.state in ("done", "failed") else None
+        rate = self.pages_extracted / max(time.time() - self.started, 1e-6)
+        # pages_total is the requested range, which may run past the end of the document
+        return round(max(self.pages_total - self.pages_extracted, 0) / rate, 1)
+
+class JobQueue:
+    """
+    Bounded pool for ingestion work. Every ingestion, blocking or background, runs here,
+    so at most `workers` of them compete with query traffic for CPU.
+    """
+    def __init__(self, workers: int = INGEST_CONCURRENCY, history: int = JOB_HISTORY):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._futures: Dict[str, Future] = {}
+        self._history = history
+        self._lock = threading.Lock()
+
+    def submit(self, owner: str, corpus_id: str, pages_total: int, fn: Callable[[Job], Dict[str, Any]]) -> Job:
+        job = Job(job_id=uuid.uuid4().hex[:12], owner=owner, corpus_id=corpus_id, pages_total=pages_total)
+        def run():
+            job.state, job.started = "running", time.time()
+            try:
+                job.result = fn(job)
+                job.state = "done"
+            except Exception as e:
+                job.state, job.error = "failed", getattr(e, "detail", None) or str(e)
+                raise
+            finally:
+                job.finished = time.time()
+            return job.result
+        with self._lock:
+            self._jobs[job.job_id] = job
+            # the submitter's context comes along, so a profiled request sees its ingestion stages
+            self._futures[job.job_id] = self._pool.submit(contextvars.copy_context().run, run)
+            self._trim()
+        return job
+
+    async def wait(self, job: Job) -> Dict[str, Any]:
+        # awaited on the event loop, so a caller waiting for a pool slot holds no threadpool
+        # thread; re-raises whatever the job raised
+        return await asyncio.wrap_future(self._futures[job.job_id])
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            states = [j.state for j in self._jobs.values()]
+        return {s: states.count(s) for s in ("queued", "running", "done", "failed")}
+
+    def _trim(self):
+        # drop the oldest finished jobs once history is full
+        finished = [j for j in self._jobs.values() if j.state in ("done", "failed")]
+        for j in finished[:max(len(finished) - self._history, 0)]:
+            del self._jobs[j.job_id]
+            self._futures.pop(j.job_id, None)
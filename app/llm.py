@@ -1,24 +1,98 @@
-import os
-from openai import OpenAI
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+import os, json, time, hashlib
+from typing import AsyncIterator
+import httpx
+from openai import AsyncOpenAI
+from .cache import TTLCache
+from . import metrics
+from .context import pack_context, count_tokens, record_prompt, QA_CONTEXT_TOKENS, NOTES_CONTEXT_TOKENS, QUIZ_CONTEXT_TOKENS
 MODEL = os.getenv("LLM_MODEL","gpt-4o-mini")
 
+# one pooled HTTP client shared by every async call, so concurrent requests reuse connections
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+_http = httpx.AsyncClient(
+    limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+    timeout=httpx.Timeout(60.0, connect=10.0),
+)
+aclient = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=_http)
+
+# identical prompts (same model, system prompt, snippets and query/style/focus) are answered from
+# cache; LLM_CACHE_DIR adds a SQLite tier shared by workers and kept across restarts
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "1024"))   # 0 disables
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))  # seconds
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "")
+response_cache = TTLCache(LLM_CACHE_SIZE, LLM_CACHE_TTL,
+                          os.path.join(LLM_CACHE_DIR, "llm.sqlite") if LLM_CACHE_DIR else None)
+
+def _usage(r):
+    # tokens billed by the API, as opposed to the estimates in context.token_stats
+    u = getattr(r, "usage", None)
+    if u is not None:
+        metrics.inc("llm_tokens", u.prompt_tokens or 0, type="prompt", model=MODEL)
+        metrics.inc("llm_tokens", u.completion_tokens or 0, type="completion", model=MODEL)
+
+def _cache_key(messages: list[dict], temperature: float) -> str:
+    return hashlib.sha256(json.dumps([MODEL, temperature, messages], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+async def _achat(messages: list[dict], temperature: float) -> str:
+    key = _cache_key(messages, temperature)
+    hit = response_cache.get(key)
+    if hit is not None:
+        return hit
+    with metrics.stage("llm", model=MODEL):
+        r = await aclient.chat.completions.create(model=MODEL, messages=messages, temperature=temperature)
+    _usage(r)
+    out = r.choices[0].message.content or ""
+    response_cache.put(key, out)
+    return out
+
+async def _astream(messages: list[dict], temperature: float) -> AsyncIterator[str]:
+    key = _cache_key(messages, temperature)
+    hit = response_cache.get(key)
+    if hit is not None:
+        yield hit
+        return
+    parts = []
+    t0 = time.perf_counter()
+    stream = await aclient.chat.completions.create(model=MODEL, messages=messages, temperature=temperature, stream=True)
+    async for ev in stream:
+        delta = ev.choices[0].delta.content if ev.choices else None
+        if delta:
+            if not parts: metrics.observe("llm_first_token", time.perf_counter() - t0, model=MODEL)
+            parts.append(delta)
+            yield delta
+    metrics.observe("llm_stream", time.perf_counter() - t0, model=MODEL)
+    response_cache.put(key, "".join(parts))
+
 QA_SYS = (
  "Answer using ONLY the provided snippets. "
  "Keep it ≤ 120 words. After each claim, cite (slide X) or (page X). "
  "If info isn’t present, say 'not found in range'."
 )
 
-def answer_with_llm(question: str, snippets: list[dict]) -> str:
+def _record(kind: str, snippets: list[dict], packed: list[dict], msgs: list[dict]):
+    record_prompt(kind, sum(count_tokens(s["text"]) for s in snippets),
+                  sum(count_tokens(s["text"]) for s in packed),
+                  sum(count_tokens(m["content"]) for m in msgs))
+
+def _qa_messages(question: str, snippets: list[dict]) -> list[dict]:
+    # snippets come ranked by similarity; the packer keeps that order
+    packed = pack_context(snippets, QA_CONTEXT_TOKENS)
     ctx = "\n\n".join(
-        f"(source {s['source_id']}) {s['text']}" for s in snippets
+        f"(source {s['source_id']}) {s['text']}" for s in packed
     )
     msgs = [
         {"role":"system","content": QA_SYS},
         {"role":"user","content": f"QUESTION: {question}\nSNIPPETS:\n{ctx}"}
     ]
-    r = client.chat.completions.create(model=MODEL, messages=msgs, temperature=0.1)
-    return r.choices[0].message.content.strip()
+    _record("qa", snippets, packed, msgs)
+    return msgs
+
+async def aanswer_with_llm(question: str, snippets: list[dict]) -> str:
+    return (await _achat(_qa_messages(question, snippets), 0.1)).strip()
+
+def astream_answer(question: str, snippets: list[dict]) -> AsyncIterator[str]:
+    # yields answer tokens as the model produces them (the whole answer at once on a cache hit)
+    return _astream(_qa_messages(question, snippets), 0.1)
 
 NOTES_SYSTEM = (
     "You are a study-notes writer. Use ONLY the provided CHUNKS. "
@@ -27,23 +101,23 @@ NOTES_SYSTEM = (
     "Return Markdown with these sections:\n"
     "## Outline\n## Key Terms\n## Formulas\n## Examples\n## Self-Checks"
 )
-def make_notes_with_llm(style: str, snippets: list[dict]) -> str:
-    # snippets: [{source_id, text}]
-    # pack up to ~25 snippets to stay cheap
-    packed = snippets[:25]
+
+def _notes_messages(style: str, snippets: list[dict]) -> list[dict]:
+    # snippets: [{source_id, text, ord?, vec?}]
+    packed = pack_context(snippets, NOTES_CONTEXT_TOKENS, keep_source_order=True)
     ctx = "\n\n".join(f"[{i+1}] (src {s['source_id']}) {s['text']}" for i, s in enumerate(packed))
     user = (
         f"STYLE: {style}\n\n"
         f"CHUNKS (with source ids):\n{ctx}\n\n"
         f"Write the Markdown now. Keep it concise and cite each bullet."
     )
-    r = client.chat.completions.create(
-        model=MODEL,
-        temperature=0.2,
-        messages=[{"role":"system","content":NOTES_SYSTEM},
-                  {"role":"user","content":user}]
-    )
-    return r.choices[0].message.content.strip()
+    msgs = [{"role":"system","content":NOTES_SYSTEM},
+            {"role":"user","content":user}]
+    _record("notes", snippets, packed, msgs)
+    return msgs
+
+async def amake_notes_with_llm(style: str, snippets: list[dict]) -> str:
+    return (await _achat(_notes_messages(style, snippets), 0.2)).strip()
 
 QUIZ_SYSTEM = (
   "You are a careful quiz writer. Use ONLY the provided snippets from slides/pages. "
@@ -52,8 +126,9 @@ QUIZ_SYSTEM = (
   "Never use outside knowledge."
 )
 
-def make_quiz_with_llm(focus: list[str], snippets: list[dict], n_items: int = 10):
-    ctx = "\n\n".join(f"(src {s['source_id']}) {s['text']}" for s in snippets[:28])
+def _quiz_messages(focus: list[str], snippets: list[dict], n_items: int) -> list[dict]:
+    packed = pack_context(snippets, QUIZ_CONTEXT_TOKENS, keep_source_order=True)
+    ctx = "\n\n".join(f"(src {s['source_id']}) {s['text']}" for s in packed)
     user = (
       f"FOCUS: {', '.join(focus)}\n\n"
       f"SNIPPETS:\n{ctx}\n\n"
@@ -68,9 +143,10 @@ def make_quiz_with_llm(focus: list[str], snippets: list[dict], n_items: int = 10
       "] }\n"
       f"Create {n_items} items. Keep questions terse and unambiguous."
     )
-    r = client.chat.completions.create(
-        model=MODEL, temperature=0.2,
-        messages=[{"role":"system","content":QUIZ_SYSTEM},
-                  {"role":"user","content":user}]
-    )
-    return r.choices[0].message.content
\ No newline at end of file
+    msgs = [{"role":"system","content":QUIZ_SYSTEM},
+            {"role":"user","content":user}]
+    _record("quiz", snippets, packed, msgs)
+    return msgs
+
+async def amake_quiz_with_llm(focus: list[str], snippets: list[dict], n_items: int = 10):
+    return await _achat(_quiz_messages(focus, snippets, n_items), 0.2)
@@ -1,49 +1,110 @@
 # app/main.py
-import os
+import os, re, json, time, asyncio, logging, datetime as dt
+from dateutil import tz
 from typing import Optional 
-from fastapi import FastAPI, HTTPException, Header
+from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-import jwt
 import uuid
 from .models import LoadMaterialRequest, LoadMaterialResponse, MakeNotesRequest, MakeNotesResponse, GenerateQuizRequest, GenerateQuizResponse, QuizItem,ScheduleQuizRequest, ScheduleQuizResponse, ScheduledEvent
-from .utils import parse_range, md5_hex
-from .ingestion import extract_pdf_pages, extract_pptx_slides, extract_docx_pages, make_chunks
-from .models import AnswerQuestionRequest, AnswerQuestionResponse
+from .models import ScheduleQuizzesRequest, ScheduleQuizzesResponse, ScheduleQuizzesResult
+from .utils import parse_range, md5_hex, missing_runs
+from .ingestion import ingest, page_count
+from .models import AnswerQuestionRequest, AnswerQuestionResponse, IngestStatusRequest, IngestStatusResponse
+from .models import AnswerQuestionsRequest, AnswerQuestionsResponse, AnswerQuestionsItem
+from .models import ExportStatusRequest, ExportStatusResponse
+from .jobs import JobQueue, Job
 from .store import VectorStore
-from .llm import answer_with_llm, make_notes_with_llm, make_quiz_with_llm
-from .schedule import gen_events_once, gen_events_spaced, write_ics, DOWNLOAD_DIR
-from .pdf import markdown_to_html, html_to_pdf, DOWNLOAD_DIR
-from .auth import require_user
+from .llm import aanswer_with_llm, amake_notes_with_llm, amake_quiz_with_llm, astream_answer
+from .schedule import gen_events_once, gen_events_spaced, write_ics, occurrences, SCHEDULE_PREVIEW_MAX, WEEKMAP
+from .pdf import export_pdf, export_status
+from .artifacts import DOWNLOAD_DIR
+from .quizzes import QuizStore, QUIZ_DB
+from .auth import require_user, auth_stats
+from .embeddings import embedding_stats
+from .llm import response_cache
+from .context import token_stats
+from .artifacts import artifacts
+from . import metrics
 
 
 load_dotenv()
+log = logging.getLogger(__name__)
 app = FastAPI(title="Study MCP — Day1")
 app.mount("/downloads", StaticFiles(directory=DOWNLOAD_DIR), name="downloads")
 
-# --------- auth helper ----------
-def _decode_bearer(authorization: str):
-    if not authorization or not authorization.lower().startswith("bearer "):
-        raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
-    token = authorization.split(" ", 1)[1]
-    issuer = os.getenv("JWT_ISSUER", "cequence")
-    audience = os.getenv("JWT_AUDIENCE", "study-mcp")
-    alg = os.getenv("JWT_ALG", "HS256")
-    secret = os.getenv("JWT_SECRET", "dev-demo-secret-change-me")
-    try:
-        return jwt.decode(
-            token, secret, algorithms=[alg], audience=audience, issuer=issuer,
-            options={"require": ["exp", "iat"]}
-        )
-    except jwt.InvalidTokenError as e:
-        raise HTTPException(status_code=401, detail=f"Invalid token: {e}")
-
 # --------- baseline routes ----------
 @app.get("/health")
 def health():
     return {"ok": True}
 
+# Prometheus text format, unauthenticated like /health; each worker reports its own numbers
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+_TOKEN_METRICS = {"calls": "prompts_total", "context_raw": "context_raw_tokens_total",
+                  "context_packed": "context_packed_tokens_total", "prompt": "prompt_tokens_total"}
+
+def _gauges():
+    # sampled at scrape time from the stores (defined further down) and the stats they already keep
+    for k, v in store.stats().items():
+        yield f"store_{k}", {}, v
+    for k, v in artifacts.stats().items():
+        yield (f"artifacts_{k}_total" if k in ("expired", "evicted", "intermediates_cleaned") else f"artifacts_{k}"), {}, v
+    yield "quizzes", {}, quizzes.stats()["quizzes"]
+    emb = embedding_stats()
+    caches = {"embedding": emb["cache"], "query_embedding": emb["query_cache"], "llm_response": response_cache.stats(),
+              "quiz": quizzes.stats()["cache"]}
+    for name, st in caches.items():
+        if st is None: continue
+        yield "cache_hits_total", {"cache": name}, st["hits"]
+        yield "cache_misses_total", {"cache": name}, st["misses"]
+        yield "cache_entries", {"cache": name}, st["entries"]
+    yield "query_embed_batches_total", {}, emb["batcher"]["batches"]
+    yield "query_embed_queries_total", {}, emb["batcher"]["queries"]
+    for k, v in list(auth_stats.items()):
+        yield ("auth_verify_seconds_total" if k == "verify_seconds" else f"auth_{k}_total"), {}, v
+    for k, v in list(token_stats.items()):
+        kind, what = k.split("_", 1)
+        yield _TOKEN_METRICS[what], {"kind": kind}, v
+    for state, n in jobs.stats().items():
+        yield "ingest_jobs", {"state": state}, n
+
+metrics.register(_gauges, store_partitions="Partitions under STORE_DIR", store_partitions_open="Partitions this worker has opened",
+                 store_vectors="Chunk vectors in open partitions", store_bytes="Bytes on disk of open partitions",
+                 store_corpora="Registered corpora", cache_hits_total="Cache hits by cache")
+
+# every request is timed per route; one sent with "X-Profile: 1" also gets a Server-Timing
+# header with the time spent in each stage (auth, embed, search, llm, ...) while serving it
+METRICS_PROFILE = os.getenv("METRICS_PROFILE", "1") == "1"  # 0 ignores X-Profile
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    prof = metrics.start_profile() if METRICS_PROFILE and request.headers.get("x-profile") == "1" else None
+    t0 = time.perf_counter()
+    response = await call_next(request)
+    route = getattr(request.scope.get("route"), "path", "other")
+    if response.headers.get("content-type", "").startswith("text/event-stream"):
+        # an event stream's body is still being generated here: it is timed to its last byte, and
+        # a header would miss its llm and streaming stages, so such routes send the complete
+        # breakdown as a final `profile` event instead
+        async def body(chunks=response.body_iterator):
+            try:
+                async for chunk in chunks:
+                    yield chunk
+            finally:
+                metrics.observe("request", time.perf_counter() - t0, route=route)
+        response.body_iterator = body()
+        return response
+    metrics.observe("request", time.perf_counter() - t0, route=route)
+    if prof is not None:
+        response.headers["Server-Timing"] = metrics.server_timing(prof)
+    return response
+
 # @app.get("/whoami")
 # def whoami(authorization: str = Header(default=None), x_user_id: str = Header(default=None)):
 #     claims = _decode_bearer(authorization)
@@ -70,11 +131,14 @@ class LoadMaterialRequest(BaseModel):
     type: str = Field(..., description='One of: "pdf","pptx","docx"')
     range: str = Field(..., description='e.g., "slides 1-5" or "pages 3-10"')
     local_path: Optional[str] = None
+    background: bool = False  # return a job_id right away; poll ingest_status
 
 class LoadMaterialResponse(BaseModel):
     corpus_id: str
     chunks_indexed: int
     sources: list[str]
+    ingest: Optional[dict] = None  # {pages, chunks, seconds, pages_per_sec} for newly ingested pages
+    job_id: Optional[str] = None   # set when background=True and pages need ingesting
 
 def _md5_hex(s: str) -> str:
     import hashlib
@@ -89,102 +153,222 @@ def _parse_range(s: str):
     return kind, a, b
 
 store = VectorStore()
+jobs = JobQueue()
 
+# async, like the LLM-bound handlers: a blocking load waits for its ingestion job on the event
+# loop, not in a threadpool thread that auth and retrieval for queries need
 @app.post("/mcp/tools/load_material", response_model=LoadMaterialResponse)
-def load_material(req: LoadMaterialRequest, authorization: str = Header(default=None)):
-    # _ = _decode_bearer(authorization)  # verifies token
-    session = require_user(authorization)
+async def load_material(req: LoadMaterialRequest, authorization: str = Header(default=None)):
+    session = await run_in_threadpool(require_user, authorization)
     user_id = session["subject"]  # use this if you need per-user storage later
 
     kind, start, end = parse_range(req.range)
     if not req.local_path or not os.path.exists(req.local_path):
         raise HTTPException(status_code=400, detail="Provide existing local_path for dev")
 
-    if req.type.lower() == "pdf" and kind == "pages":
-        items = extract_pdf_pages(req.local_path, start, end)
-    elif req.type.lower() == "pptx" and kind == "slides":
-        items = extract_pptx_slides(req.local_path, start, end)
-    elif req.type.lower() == "docx":
-        items = extract_docx_pages(req.local_path, start, end)
-    else:
+    ftype = req.type.lower()
+    if not ((ftype == "pdf" and kind == "pages") or (ftype == "pptx" and kind == "slides") or ftype == "docx"):
         raise HTTPException(status_code=400, detail="Type/range mismatch. Use 'pages' for pdf/docx and 'slides' for pptx.")
 
+    # chunks are stored once per file; a corpus is a page/slide range over them, so repeat
+    # loads are no-ops and a wider range only extracts and embeds the pages not indexed yet
+    file_key = md5_hex(f"{req.file_id}:{ftype}")[:12]
     corpus_id = md5_hex(f"{req.file_id}:{req.type}:{req.range}")[:12]
-    chunks = make_chunks(kind, items, corpus_id)
-    if not chunks:
-        raise HTTPException(status_code=422, detail="No text extracted in the specified range")
-
-    store.add_corpus(corpus_id, chunks)
-    sources = sorted({c.source_id for c in chunks}, key=lambda x: int(x))
-    return LoadMaterialResponse(corpus_id=corpus_id, chunks_indexed=len(chunks), sources=sources)
-
+    # a range past the end of the document stops at its last page ("pages 1-999999" is one page
+    # count, not a million-page walk); a docx learns its length the first time it is read through
+    def plan():
+        n = page_count(ftype, req.local_path)
+        if n is None: return n, end
+        if start > n: raise HTTPException(status_code=400, detail=f"Range starts past the end of the document ({n} {kind})")
+        return n, min(end, n)
+    n, end = await run_in_threadpool(plan)
+    runs = missing_runs(start, end, await run_in_threadpool(store.indexed_sources, file_key))
+
+    def done(stats: Optional[dict]) -> LoadMaterialResponse:
+        # the corpus records the clamped end, so it covers exactly the pages that exist
+        last = end if n is not None else min(end, page_count(ftype, req.local_path) or end)
+        store.register_corpus(corpus_id, file_key, start, last)
+        n_chunks, sources = store.corpus_sources(corpus_id)
+        if not n_chunks:
+            raise HTTPException(status_code=422, detail="No text extracted in the specified range")
+        return LoadMaterialResponse(corpus_id=corpus_id, chunks_indexed=n_chunks, sources=sources, ingest=stats)
+
+    # everything already indexed: no extraction, so no job and no wait for a pool slot
+    if not runs:
+        return await run_in_threadpool(done, None)
+
+    def run(job: Job) -> dict:
+        def sink(sources, chunks):
+            store.add_file_chunks(file_key, sources, chunks)
+            job.progress(len(sources), len(chunks))
+        # every extracted page is recorded, empty ones included, so it is not extracted again
+        return done(ingest(ftype, kind, req.local_path, runs, file_key, sink)).model_dump()
+
+    # both paths go through the bounded ingestion pool
+    job = jobs.submit(user_id, corpus_id, sum(b - a + 1 for a, b in runs), run)
+    if req.background:
+        return LoadMaterialResponse(corpus_id=corpus_id, chunks_indexed=0, sources=[], job_id=job.job_id)
+    return LoadMaterialResponse(**await jobs.wait(job))
+
+
+@app.post("/mcp/tools/ingest_status", response_model=IngestStatusResponse)
+def ingest_status(req: IngestStatusRequest, authorization: str = Header(default=None)):
+    session = require_user(authorization)
+    job = jobs.get(req.job_id)
+    if job is None or job.owner != session["subject"]:
+        raise HTTPException(status_code=404, detail="Unknown job_id")
+    return IngestStatusResponse(
+        job_id=job.job_id, state=job.state, corpus_id=job.corpus_id, pages_total=job.pages_total,
+        pages_extracted=job.pages_extracted, chunks_embedded=job.chunks_embedded,
+        eta_seconds=job.eta_seconds(), error=job.error, result=job.result,
+    )
+
+
+def _retrieve(query: str, corpus_id: str, top_k: int):
+    return _snippets(store.search(query, corpus_id, k=top_k), top_k)
+
+def _snippets(hits, top_k: int):
+    ids = [i for i,_ in hits]
+    chunks = store.get_chunks(ids)
+    # full chunks plus score/ordinal/vector: the context packer merges overlaps and fits the token budget
+    snippets = [
+        {"source_id": c.source_id, "text": c.text, "ord": int(c.uid.rsplit(":", 1)[1]), "score": score, "vec": v}
+        for c, (_, score), v in zip(chunks, hits, store.get_vectors(ids))
+    ]
+    cits = [{"source_id": c.source_id, "excerpt": c.text[:140]} for c in chunks[:top_k]]
+    return snippets, cits
 
+# LLM-bound handlers are async: the OpenAI call awaits on the shared pooled client instead of
+# holding a threadpool slot; auth (a JWKS fetch on a cold key cache), embedding and faiss work
+# still run in the threadpool
 @app.post("/mcp/tools/answer_question", response_model=AnswerQuestionResponse)
-def answer_question(req: AnswerQuestionRequest, authorization: str = Header(default=None)):
-    _ = _decode_bearer(authorization)
-    session = require_user(authorization)
+async def answer_question(req: AnswerQuestionRequest, authorization: str = Header(default=None)):
+    session = await run_in_threadpool(require_user, authorization)
     user_id = session["subject"]  # use this if you need per-user storage later
 
-    hits = store.search(req.query, req.corpus_id, k=req.top_k)
-    if not hits:
+    snippets, cits = await run_in_threadpool(_retrieve, req.query, req.corpus_id, req.top_k)
+    if not snippets:
         return AnswerQuestionResponse(answer="not found in range", citations=[])
-    chunks = store.get_chunks([i for i,_ in hits])
-    snippets = [
-        {"source_id": c.source_id, "text": c.text[:500]}
-        for c in chunks
-    ]
-    ans = answer_with_llm(req.query, snippets[:min(req.top_k, len(snippets))])
-    cits = [{"source_id": c.source_id, "excerpt": c.text[:140]} for c in chunks[:req.top_k]]
+    ans = await aanswer_with_llm(req.query, snippets)
     return AnswerQuestionResponse(answer=ans, citations=cits)
 
+# questions in one batch share the auth check, one embedding pass and one faiss search; their
+# LLM calls run concurrently, at most QA_BATCH_CONCURRENCY at a time
+QA_BATCH_MAX = int(os.getenv("QA_BATCH_MAX", "50"))                   # questions per call
+QA_BATCH_CONCURRENCY = int(os.getenv("QA_BATCH_CONCURRENCY", "8"))    # LLM calls in flight per call
+
+@app.post("/mcp/tools/answer_questions", response_model=AnswerQuestionsResponse)
+async def answer_questions(req: AnswerQuestionsRequest, authorization: str = Header(default=None)):
+    session = await run_in_threadpool(require_user, authorization)
+    if len(req.queries) > QA_BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {QA_BATCH_MAX} queries per call")
+
+    asked = [i for i, q in enumerate(req.queries) if q.strip()]
+    def retrieve():
+        hits = store.search_many([req.queries[i] for i in asked], req.corpus_id, k=req.top_k)
+        return dict(zip(asked, (_snippets(h, req.top_k) for h in hits)))
+    found = await run_in_threadpool(retrieve)
+
+    sem = asyncio.Semaphore(max(QA_BATCH_CONCURRENCY, 1))
+    async def answer(i: int, query: str) -> AnswerQuestionsItem:
+        if i not in found:
+            return AnswerQuestionsItem(query=query, error="empty query")
+        snippets, cits = found[i]
+        if not snippets:
+            return AnswerQuestionsItem(query=query, answer="not found in range")
+        try:
+            async with sem:
+                ans = await aanswer_with_llm(query, snippets)
+        except Exception as e:  # one failed answer doesn't fail the batch
+            return AnswerQuestionsItem(query=query, error=f"{type(e).__name__}: {e}")
+        return AnswerQuestionsItem(query=query, answer=ans, citations=cits)
+
+    return AnswerQuestionsResponse(answers=await asyncio.gather(*(answer(i, q) for i, q in enumerate(req.queries))))
+
+@app.post("/mcp/tools/answer_question_stream")
+async def answer_question_stream(req: AnswerQuestionRequest, authorization: str = Header(default=None)):
+    """
+    Server-sent events: `token` events carry answer text as it is generated, then one
+    `citations` event and a final `done`. If generation fails part-way, an `error` event
+    comes before them, so a cut-off answer is never mistaken for a complete one.
+    """
+    session = await run_in_threadpool(require_user, authorization)
+
+    snippets, cits = await run_in_threadpool(_retrieve, req.query, req.corpus_id, req.top_k)
+
+    def sse(event: str, data) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    async def events():
+        try:
+            if not snippets:
+                yield sse("token", "not found in range")
+            else:
+                async for tok in astream_answer(req.query, snippets):
+                    yield sse("token", tok)
+        except Exception as e:  # OpenAI error, timeout, upstream connection dropped
+            log.warning("answer stream failed: %s: %s", type(e).__name__, e)
+            yield sse("error", {"detail": f"{type(e).__name__}: {e}"})
+        # not a `finally`: when the client itself disconnects the generator is closed and can't
+        # yield, and there is no one left to tell
+        yield sse("citations", cits if snippets else [])
+        prof = metrics.current_profile()
+        if prof is not None:
+            yield sse("profile", {"server_timing": metrics.server_timing(prof)})
+        yield sse("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.post("/mcp/tools/make_notes", response_model=MakeNotesResponse)
-def make_notes(req: MakeNotesRequest, authorization: str = Header(default=None)):
+async def make_notes(req: MakeNotesRequest, authorization: str = Header(default=None)):
     
-    session = require_user(authorization)
+    session = await run_in_threadpool(require_user, authorization)
     user_id = session["subject"]  # use this if you need per-user storage later
 
-    # auth check (reuse your existing _decode_bearer)
-    _ = _decode_bearer(authorization)
-
     # collect snippets from corpus
-    snippets = store.all_chunks_for_corpus(req.corpus_id, max_per_source=4, max_total=28)
+    snippets = await run_in_threadpool(store.all_chunks_for_corpus, req.corpus_id, max_per_source=4, max_total=28)
     if not snippets:
         raise HTTPException(status_code=404, detail="No chunks for this corpus_id; load material first.")
 
     # call LLM
-    notes_md = make_notes_with_llm(req.style, snippets)
+    notes_md = await amake_notes_with_llm(req.style, snippets)
 
-    # optional export to PDF
-    pdf_url = None
+    # optional export to PDF: rendered in the background (or reused when these exact notes were
+    # exported before); the URL under /downloads is returned right away
+    pdf_url = pdf_state = None
     if req.export_pdf:
-        html = markdown_to_html(notes_md)
-        pdf_path = html_to_pdf(html, filename_hint=f"notes-{req.corpus_id}")
-        # turn path into URL under /downloads
-        fname = os.path.basename(pdf_path)
+        fname, pdf_state = export_pdf(notes_md, filename_hint="notes")
         pdf_url = f"/downloads/{fname}"
 
-    return MakeNotesResponse(notes_md=notes_md, pdf_url=pdf_url)
+    return MakeNotesResponse(notes_md=notes_md, pdf_url=pdf_url, pdf_state=pdf_state)
 
+@app.post("/mcp/tools/export_status", response_model=ExportStatusResponse)
+def pdf_export_status(req: ExportStatusRequest, authorization: str = Header(default=None)):
+    require_user(authorization)
+    state, error = export_status(req.pdf_url.rsplit("/", 1)[-1])
+    return ExportStatusResponse(pdf_url=req.pdf_url, state=state, error=error)
 
-QUIZZES: dict[str, list[dict]] = {}
 
-@app.post("/mcp/tools/generate_quiz", response_model=GenerateQuizResponse)
-def generate_quiz(req: GenerateQuizRequest, authorization: str = Header(default=None)):
-    session = require_user(authorization)
-    user_id = session["subject"]  # use this if you need per-user storage later
+# quizzes live in SQLite, so any worker can schedule a quiz another one generated
+quizzes = QuizStore(QUIZ_DB)
+SCHEDULE_BULK_MAX = int(os.getenv("SCHEDULE_BULK_MAX", "200"))  # entries per schedule_quizzes call
 
-    _ = _decode_bearer(authorization)
+@app.post("/mcp/tools/generate_quiz", response_model=GenerateQuizResponse)
+async def generate_quiz(req: GenerateQuizRequest, authorization: str = Header(default=None)):
+    session = await run_in_threadpool(require_user, authorization)
+    user_id = session["subject"]  # the quiz belongs to this user
 
     # collect snippets from this corpus
-    snippets = store.all_chunks_for_corpus(req.corpus_id, max_per_source=4, max_total=28)
+    snippets = await run_in_threadpool(store.all_chunks_for_corpus, req.corpus_id, max_per_source=4, max_total=28)
     if not snippets:
         raise HTTPException(status_code=404, detail="No chunks for this corpus_id; load material first.")
 
     # call LLM
-    raw = make_quiz_with_llm(req.focus, snippets, n_items=req.items)
+    raw = await amake_quiz_with_llm(req.focus, snippets, n_items=req.items)
 
     # parse LLM JSON safely
-    import json, re
+    import re
     try:
         js = json.loads(raw)
     except Exception:
@@ -207,21 +391,33 @@ def generate_quiz(req: GenerateQuizRequest, authorization: str = Header(default=
         raise HTTPException(status_code=500, detail="Quiz generation failed")
 
     quiz_id = uuid.uuid4().hex[:12]
-    QUIZZES[quiz_id] = items
+    await run_in_threadpool(quizzes.save, quiz_id, user_id, items)
     return GenerateQuizResponse(quiz_id=quiz_id, items=[QuizItem(**i) for i in items])
 
 
-@app.post("/mcp/tools/schedule_quiz", response_model=ScheduleQuizResponse)
-def schedule_quiz(req: ScheduleQuizRequest, authorization: str = Header(default=None)):
-    session = require_user(authorization)
-    user_id = session["subject"]  # use this if you need per-user storage later
-
-    _ = _decode_bearer(authorization)
-
-    items = QUIZZES.get(req.quiz_id)
+_WINDOW = re.compile(r"([01]?\d|2[0-3]):([0-5]\d)-([01]?\d|2[0-3]):([0-5]\d)")
+
+def _check_plan(req: ScheduleQuizRequest):
+    # bad input is a 400 for this entry, never a 500 from deep inside the event generators
+    p = req.plan
+    if p.window and not _WINDOW.fullmatch(p.window):
+        raise HTTPException(status_code=400, detail="window must look like '19:00-21:00'")
+    if p.days and not set(p.days) <= set(WEEKMAP):
+        raise HTTPException(status_code=400, detail=f"days must be among {', '.join(WEEKMAP)}")
+    if p.end_date:
+        try:
+            dt.date.fromisoformat(p.end_date)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="end_date must be YYYY-MM-DD")
+    if req.tz and tz.gettz(req.tz) is None:
+        raise HTTPException(status_code=400, detail=f"Unknown time zone {req.tz!r}")
+
+def _plan_quiz(req: ScheduleQuizRequest, user_id: str):
+    items = quizzes.get(req.quiz_id, user_id)  # only the user who generated the quiz can schedule it
     if not items:
         raise HTTPException(status_code=404, detail="Unknown quiz_id")
 
+    _check_plan(req)
     # Build description with quick summary + link back (you can add your UI link here)
     desc = f"Auto-generated 10-min quiz ({len(items)} items).\n"
     # choose events
@@ -233,15 +429,47 @@ def schedule_quiz(req: ScheduleQuizRequest, authorization: str = Header(default=
         events = gen_events_spaced(req.plan.end_date, req.plan.days, req.tz, req.plan.window, f"{req.title}")
     else:
         raise HTTPException(status_code=400, detail="mode must be 'once' or 'spaced'")
+    return [e._replace(description=desc, attendees=tuple(req.attendees or ()), quiz_id=req.quiz_id) for e in events]
+
+def _event_out(events, preview: bool):
+    # previews list the actual dates (up to SCHEDULE_PREVIEW_MAX); otherwise one entry per series
+    if preview: events = occurrences(events, SCHEDULE_PREVIEW_MAX)
+    return [ScheduledEvent(start=e.start.isoformat(), end=e.end.isoformat(), title=e.title,
+                           description=e.description, rrule=e.rrule) for e in events]
+
+@app.post("/mcp/tools/schedule_quiz", response_model=ScheduleQuizResponse)
+def schedule_quiz(req: ScheduleQuizRequest, authorization: str = Header(default=None)):
+    session = require_user(authorization)
+    events = _plan_quiz(req, session["subject"])
 
     # If confirm is False, return a preview only
-    evs_out = [ScheduledEvent(start=e[0].isoformat(), end=e[1].isoformat(), title=e[2], description=desc) for e in events]
     if not req.confirm:
-        return ScheduleQuizResponse(events=evs_out, preview_only=True)
+        return ScheduleQuizResponse(events=_event_out(events, preview=True), preview_only=True)
 
     # Write ICS and expose via /downloads
-    ics_path = write_ics(events, name_hint=f"quiz-{req.quiz_id}", description=desc)
+    ics_path = write_ics(events, name_hint=f"quiz-{req.quiz_id}")
     fname = os.path.basename(ics_path)
     ics_url = f"/downloads/{fname}"
-    return ScheduleQuizResponse(events=evs_out, ics_url=ics_url, preview_only=False)
+    return ScheduleQuizResponse(events=_event_out(events, preview=False), ics_url=ics_url, preview_only=False)
+
+
+@app.post("/mcp/tools/schedule_quizzes", response_model=ScheduleQuizzesResponse)
+def schedule_quizzes(req: ScheduleQuizzesRequest, authorization: str = Header(default=None)):
+    # many quizzes in one call and one calendar; a bad entry is reported, not fatal
+    session = require_user(authorization)
+    if len(req.entries) > SCHEDULE_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {SCHEDULE_BULK_MAX} entries per call")
+    results, combined = [], []
+    for entry in req.entries:
+        try:
+            events = _plan_quiz(entry, session["subject"])
+        except HTTPException as e:
+            results.append(ScheduleQuizzesResult(quiz_id=entry.quiz_id, error=e.detail))
+            continue
+        combined.extend(events)
+        results.append(ScheduleQuizzesResult(quiz_id=entry.quiz_id, events=_event_out(events, preview=not req.confirm)))
+    if not req.confirm or not combined:
+        return ScheduleQuizzesResponse(results=results, preview_only=not req.confirm)
+    ics_path = write_ics(combined, name_hint="quizzes")
+    return ScheduleQuizzesResponse(results=results, ics_url=f"/downloads/{os.path.basename(ics_path)}")
 
@@ -0,0 +1,140 @@
+import os, time, bisect, threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# process-local metrics in Prometheus text format: per-stage latency histograms, counters, and
+# gauges read from the stores at scrape time. With several workers each one reports its own.
+METRICS_PREFIX = os.getenv("METRICS_PREFIX", "study")
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+Sample = Tuple[str, Dict[str, str], float]  # name, labels, value
+
+_lock = threading.Lock()
+_hist: Dict[Labels, List[float]] = {}       # stage labels -> bucket counts + [sum, count]
+_counters: Dict[Tuple[str, Labels], float] = {}
+_help: Dict[str, str] = {}
+_collectors: List[Callable[[], Iterable[Sample]]] = []
+
+# stage -> [seconds, calls] for the current request when profiling was asked for; threadpool calls
+# copy the context, so they add to the same dict
+_profile: ContextVar[Optional[Dict[str, List[float]]]] = ContextVar("profile", default=None)
+
+def _key(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def observe(stage: str, seconds: float, **labels):
+    key = _key({"stage": stage, **labels})
+    with _lock:
+        h = _hist.get(key)
+        if h is None:
+            h = _hist[key] = [0.0] * (len(BUCKETS) + 2)
+        i = bisect.bisect_left(BUCKETS, seconds)
+        if i < len(BUCKETS): h[i] += 1
+        h[-2] += seconds
+        h[-1] += 1
+    prof = _profile.get()
+    if prof is not None:
+        with _lock:
+            p = prof.setdefault(stage, [0.0, 0])
+            p[0] += seconds; p[1] += 1
+
+@contextmanager
+def stage(name: str, **labels):
+    """Time the block as `name`; failures are timed too."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+def timed(items: Iterable, name: str, **labels) -> Iterator:
+    """Re-yield `items`, timing each wait for the next one (lazy extractors, worker futures)."""
+    it = iter(items)
+    while True:
+        t0 = time.perf_counter()
+        try:
+            x = next(it)
+        except StopIteration:
+            return
+        observe(name, time.perf_counter() - t0, **labels)
+        yield x
+
+def inc(name: str, n: float = 1, help: str = "", **labels):
+    if help: _help.setdefault(name, help)
+    key = (name, _key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+def register(fn: Callable[[], Iterable[Sample]], **help: str):
+    # fn runs at every scrape and yields (name, labels, value); names ending in _total are counters
+    # kept elsewhere (e.g. cache hits), the rest gauges
+    _help.update(help)
+    _collectors.append(fn)
+
+def start_profile() -> Dict[str, List[float]]:
+    prof: Dict[str, List[float]] = {}
+    _profile.set(prof)
+    return prof
+
+def current_profile() -> Optional[Dict[str, List[float]]]:
+    # the profile the current request is collecting, if it asked for one
+    return _profile.get()
+
+def server_timing(prof: Dict[str, List[float]]) -> str:
+    # Server-Timing header value: stage;dur=<ms total>;desc="<calls> calls"
+    return ", ".join(f'{s};dur={t * 1000:.2f};desc="{n} calls"' for s, (t, n) in sorted(prof.items(), key=lambda kv: -kv[1][0]))
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    # {"stage" or "stage{label=value,...}": {"count", "seconds"}}, for reports and benchmarks
+    with _lock:
+        hist = {k: (v[-1], v[-2]) for k, v in _hist.items()}
+    out = {}
+    for labels, (n, secs) in sorted(hist.items()):
+        d = dict(labels)
+        name = d.pop("stage")
+        rest = ",".join(f"{k}={v}" for k, v in d.items())
+        out[name + (f"{{{rest}}}" if rest else "")] = {"count": n, "seconds": round(secs, 4)}
+    return out
+
+def _esc(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _fmt(name: str, labels, value: float) -> str:
+    lab = ",".join(f'{k}="{_esc(v)}"' for k, v in (labels.items() if isinstance(labels, dict) else labels))
+    return f"{name}{{{lab}}} {value:.15g}" if lab else f"{name} {value:.15g}"
+
+def render() -> str:
+    p = METRICS_PREFIX
+    out = [f"# HELP {p}_stage_seconds Time spent per stage", f"# TYPE {p}_stage_seconds histogram"]
+    with _lock:
+        hist = {k: list(v) for k, v in _hist.items()}
+        counters = dict(_counters)
+    for labels, h in sorted(hist.items()):
+        cum = 0.0
+        for le, c in zip(BUCKETS, h):
+            cum += c
+            out.append(_fmt(f"{p}_stage_seconds_bucket", labels + (("le", f"{le:g}"),), cum))
+        out.append(_fmt(f"{p}_stage_seconds_bucket", labels + (("le", "+Inf"),), h[-1]))
+        out.append(_fmt(f"{p}_stage_seconds_sum", labels, h[-2]))
+        out.append(_fmt(f"{p}_stage_seconds_count", labels, h[-1]))
+    seen = set()
+    for (name, labels), v in sorted(counters.items()):
+        if name not in seen:
+            seen.add(name)
+            if name in _help: out.append(f"# HELP {p}_{name}_total {_help[name]}")
+            out.append(f"# TYPE {p}_{name}_total counter")
+        out.append(_fmt(f"{p}_{name}_total", labels, v))
+    gauges: Dict[str, List[str]] = {}
+    for fn in _collectors:
+        try:
+            for name, labels, v in fn():
+                gauges.setdefault(name, []).append(_fmt(f"{p}_{name}", labels, float(v)))
+        except Exception as e:  # one broken source doesn't take the scrape down
+            out.append(f"# collector {getattr(fn, '__name__', fn)} failed: {type(e).__name__}")
+    for name, lines in gauges.items():
+        if name in _help: out.append(f"# HELP {p}_{name} {_help[name]}")
+        out.append(f"# TYPE {p}_{name} {'counter' if name.endswith('_total') else 'gauge'}")
+        out.extend(lines)
+    return "\n".join(out) + "\n"
@@ -6,11 +6,28 @@ class LoadMaterialRequest(BaseModel):
     type: str = Field(..., description='One of: "pdf","pptx","docx"')
     range: str = Field(..., description='e.g., "slides 1-35" or "pages 3-20"')
     local_path: Optional[str] = None  # dev-only: local file path
+    background: bool = False          # return a job_id right away; poll ingest_status
 
 class LoadMaterialResponse(BaseModel):
     corpus_id: str
     chunks_indexed: int
     sources: List[str]
+    ingest: Optional[Dict[str, float]] = None  # {pages, chunks, seconds, pages_per_sec} for newly ingested pages
+    job_id: Optional[str] = None               # set when background=True and pages need ingesting
+
+class IngestStatusRequest(BaseModel):
+    job_id: str
+
+class IngestStatusResponse(BaseModel):
+    job_id: str
+    state: str                 # "queued" | "running" | "done" | "failed"
+    corpus_id: str
+    pages_total: int           # pages/slides requested that were not indexed yet
+    pages_extracted: int
+    chunks_embedded: int
+    eta_seconds: Optional[float] = None
+    error: Optional[str] = None
+    result: Optional[LoadMaterialResponse] = None
 
 class AnswerQuestionRequest(BaseModel):
     corpus_id: str
@@ -21,6 +38,20 @@ class AnswerQuestionResponse(BaseModel):
     answer: str
     citations: List[Dict[str, str]]  # [{source_id, excerpt}]
 
+class AnswerQuestionsRequest(BaseModel):
+    corpus_id: str
+    queries: List[str]
+    top_k: int = 6
+
+class AnswerQuestionsItem(BaseModel):
+    query: str
+    answer: Optional[str] = None
+    citations: List[Dict[str, str]] = []
+    error: Optional[str] = None      # set instead of answer when this question failed
+
+class AnswerQuestionsResponse(BaseModel):
+    answers: List[AnswerQuestionsItem]  # same order as queries
+
 
 class MakeNotesRequest(BaseModel):
     corpus_id: str
@@ -30,6 +61,15 @@ class MakeNotesRequest(BaseModel):
 class MakeNotesResponse(BaseModel):
     notes_md: str
     pdf_url: Optional[str] = None
+    pdf_state: Optional[str] = None  # "done" | "pending"; poll export_status until done
+
+class ExportStatusRequest(BaseModel):
+    pdf_url: str
+
+class ExportStatusResponse(BaseModel):
+    pdf_url: str
+    state: str                       # "done" | "pending" | "failed" | "missing"
+    error: Optional[str] = None
 
 class QuizItem(BaseModel):
     qtype: str                 # "mcq" | "short" | "cloze"
@@ -62,15 +102,31 @@ class ScheduleQuizRequest(BaseModel):
     title: str = "Pop Quiz"
     tz: Optional[str] = None         # e.g., "America/Los_Angeles"
     confirm: bool = True             # if False, return a summary preview only
+    attendees: Optional[List[str]] = None  # emails invited to the events
 
 class ScheduledEvent(BaseModel):
     start: str       # ISO
     end: str         # ISO
     title: str
     description: str
+    rrule: Optional[str] = None      # set on recurring events; start/end are the first occurrence
 
 class ScheduleQuizResponse(BaseModel):
     events: List[ScheduledEvent]
     ics_url: Optional[str] = None
     preview_only: bool = False
 
+class ScheduleQuizzesRequest(BaseModel):
+    entries: List[ScheduleQuizRequest]  # each entry's own `confirm` is ignored
+    confirm: bool = True
+
+class ScheduleQuizzesResult(BaseModel):
+    quiz_id: str
+    events: List[ScheduledEvent] = []
+    error: Optional[str] = None
+
+class ScheduleQuizzesResponse(BaseModel):
+    results: List[ScheduleQuizzesResult]  # same order as the entries
+    ics_url: Optional[str] = None         # one calendar with every scheduled entry
+    preview_only: bool = False
+
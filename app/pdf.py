@@ -1,40 +1,161 @@
-import os, uuid
+import os, json, time, hashlib, threading, logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, Dict
 import markdown2
 import pdfkit
+import fitz  # PyMuPDF
+from .artifacts import artifacts
+from . import metrics
 
-DOWNLOAD_DIR = os.path.join(os.getcwd(), "downloads")
-os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+log = logging.getLogger(__name__)
+
+# exports render on a small pool off the request path; markers for renders in progress or
+# failed live here (not under /downloads), so every worker sees the same state. Finished PDFs
+# go to the artifact store, which expires and evicts them
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+PDF_TIMEOUT = float(os.getenv("PDF_TIMEOUT", "300"))  # a render pending longer than this is retried
+PDF_STATE_DIR = os.getenv("PDF_STATE_DIR", os.path.join(os.getcwd(), "data", "pdf_jobs"))
+os.makedirs(PDF_STATE_DIR, exist_ok=True)
+_pool = ThreadPoolExecutor(max_workers=PDF_WORKERS, thread_name_prefix="pdf")
+PDF_RENDERER = os.getenv("PDF_RENDERER", "auto")  # auto (PyMuPDF, wkhtmltopdf if it fails) | pymupdf | wkhtmltopdf
+
+# basic options; add margins for readability (margins apply to both renderers)
+PDF_OPTIONS = {
+    "quiet": "",
+    "enable-local-file-access": "",
+    "margin-top": "10mm",
+    "margin-right": "10mm",
+    "margin-bottom": "12mm",
+    "margin-left": "10mm",
+    "print-media-type": "",
+    "dpi": 300
+}
 
 def markdown_to_html(md_text: str) -> str:
     # simple, clean HTML from Markdown
     return markdown2.markdown(md_text, extras=["tables","fenced-code-blocks","strike"])
 
-def html_to_pdf(html: str, filename_hint: str = "notes") -> str:
-    # pick a deterministic-ish filename
-    stem = f"{filename_hint}-{uuid.uuid4().hex[:8]}"
-    html_path = os.path.join(DOWNLOAD_DIR, f"{stem}.html")
-    pdf_path = os.path.join(DOWNLOAD_DIR, f"{stem}.pdf")
-
-    with open(html_path, "w", encoding="utf-8") as f:
-        f.write(_wrap_html(html))
-
-    # find wkhtmltopdf
-    wkhtml = os.getenv("WKHTMLTOPDF_PATH")
-    cfg = pdfkit.configuration(wkhtmltopdf=wkhtml) if wkhtml else None
-
-    # basic options; add margins for readability
-    opts = {
-        "quiet": "",
-        "enable-local-file-access": "",
-        "margin-top": "10mm",
-        "margin-right": "10mm",
-        "margin-bottom": "12mm",
-        "margin-left": "10mm",
-        "print-media-type": "",
-        "dpi": 300
-    }
-    pdfkit.from_file(html_path, pdf_path, options=opts, configuration=cfg)
-    return pdf_path
+def _mm(v: str) -> float:
+    return float(v.rstrip("m")) * 72 / 25.4
+
+class WkhtmltopdfRenderer:
+    """Spawns wkhtmltopdf through pdfkit; full WebKit layout, needs the binary installed."""
+    name = "wkhtmltopdf"
+
+    def render(self, doc_html: str, out_path: str):
+        html_path = out_path + ".html"
+        with open(html_path, "w", encoding="utf-8") as f:
+            f.write(doc_html)
+        # find wkhtmltopdf
+        wkhtml = os.getenv("WKHTMLTOPDF_PATH")
+        cfg = pdfkit.configuration(wkhtmltopdf=wkhtml) if wkhtml else None
+        try:
+            pdfkit.from_file(html_path, out_path, options=PDF_OPTIONS, configuration=cfg)
+        finally:
+            os.remove(html_path)
+
+class PyMuPDFRenderer:
+    """
+    Lays the HTML out in-process with PyMuPDF's Story on A4 pages with the PDF_OPTIONS margins.
+    MuPDF's HTML/CSS support is basic but covers what notes Markdown produces.
+    """
+    name = "pymupdf"
+    _lock = threading.Lock()  # MuPDF calls are not thread-safe
+
+    def render(self, doc_html: str, out_path: str):
+        page = fitz.paper_rect("a4")
+        where = page + (_mm(PDF_OPTIONS["margin-left"]), _mm(PDF_OPTIONS["margin-top"]),
+                        -_mm(PDF_OPTIONS["margin-right"]), -_mm(PDF_OPTIONS["margin-bottom"]))
+        with self._lock:
+            story = fitz.Story(html=doc_html)
+            writer = fitz.DocumentWriter(out_path)
+            more = True
+            while more:
+                dev = writer.begin_page(page)
+                more, _ = story.place(where)
+                story.draw(dev)
+                writer.end_page()
+            writer.close()
+
+RENDERERS: Dict[str, object] = {"pymupdf": PyMuPDFRenderer(), "wkhtmltopdf": WkhtmltopdfRenderer()}
+
+def _renderers() -> list:
+    if PDF_RENDERER == "auto":
+        return [RENDERERS["pymupdf"], RENDERERS["wkhtmltopdf"]]
+    return [RENDERERS[PDF_RENDERER]]
+
+def pdf_name(md_text: str, filename_hint: str = "notes") -> str:
+    # same Markdown + same renderer and options (page template included) = same file
+    key = hashlib.sha256(json.dumps([md_text, PDF_RENDERER, PDF_OPTIONS, _wrap_html("")]).encode("utf-8")).hexdigest()[:16]
+    return f"{filename_hint}-{key}.pdf"
+
+def html_to_pdf(html: str, filename_hint: str = "notes", name: Optional[str] = None) -> str:
+    # render to a temp file and rename, so a PDF under /downloads is always complete; a temp
+    # file left by a crash is dot-named, so the artifact sweep removes it
+    name = name or f"{filename_hint}-{hashlib.sha256(html.encode('utf-8')).hexdigest()[:16]}.pdf"
+    tmp = artifacts.path(f".{name}.{os.getpid()}.{threading.get_ident()}.pdf")
+    doc_html = _wrap_html(html)
+    renderers = _renderers()
+    try:
+        for i, r in enumerate(renderers):
+            try:
+                with metrics.stage("pdf_render", renderer=r.name):
+                    r.render(doc_html, tmp)
+                break
+            except Exception:
+                if i == len(renderers) - 1: raise
+                log.warning("%s renderer failed for %s, falling back", r.name, name, exc_info=True)
+        artifacts.commit(tmp, name)
+    finally:
+        if os.path.exists(tmp): os.remove(tmp)
+    return artifacts.path(name)
+
+def _state(name: str, suffix: str) -> str:
+    return os.path.join(PDF_STATE_DIR, f"{name}.{suffix}")
+
+def _render(md_text: str, name: str):
+    try:
+        with metrics.stage("markdown"):
+            html = markdown_to_html(md_text)
+        html_to_pdf(html, name=name)
+    except Exception as e:
+        log.exception("PDF export %s failed", name)
+        with open(_state(name, "failed"), "w", encoding="utf-8") as f:
+            f.write(str(e) or type(e).__name__)
+    finally:
+        if os.path.exists(_state(name, "pending")): os.remove(_state(name, "pending"))
+
+def export_pdf(md_text: str, filename_hint: str = "notes") -> Tuple[str, str]:
+    """
+    Queue md_text for PDF rendering unless the same export already exists or is under way.
+    Returns (file name under /downloads, "done" | "pending") without waiting for the render.
+    """
+    name = pdf_name(md_text, filename_hint)
+    if artifacts.touch(name):
+        return name, "done"
+    pending = _state(name, "pending")
+    try:
+        os.close(os.open(pending, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        if time.time() - os.path.getmtime(pending) < PDF_TIMEOUT:
+            return name, "pending"
+        os.utime(pending)  # the worker that claimed it died; take over
+    if os.path.exists(_state(name, "failed")): os.remove(_state(name, "failed"))
+    _pool.submit(_render, md_text, name)
+    return name, "pending"
+
+def export_status(name: str) -> Tuple[str, Optional[str]]:
+    # ("done" | "pending" | "failed" | "missing", error)
+    if not name.endswith(".pdf") or os.path.basename(name) != name:
+        return "missing", None
+    if artifacts.exists(name):
+        return "done", None
+    try:
+        with open(_state(name, "failed"), encoding="utf-8") as f:
+            return "failed", f.read()
+    except FileNotFoundError:
+        pass
+    return ("pending", None) if os.path.exists(_state(name, "pending")) else ("missing", None)
 
 def _wrap_html(body: str) -> str:
     return f"""<!doctype html>
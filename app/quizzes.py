@@ -0,0 +1,62 @@
+import os, json, time, sqlite3, threading
+from typing import List, Dict, Optional
+from .cache import TTLCache
+
+# generated quizzes, shared by every worker and kept across restarts; each belongs to the
+# subject that generated it and expires after QUIZ_TTL
+QUIZ_DB = os.getenv("QUIZ_DB", os.path.join(os.getcwd(), "data", "quizzes.sqlite"))
+QUIZ_TTL = float(os.getenv("QUIZ_TTL", str(30 * 86400)))         # seconds
+QUIZ_CACHE_SIZE = int(os.getenv("QUIZ_CACHE_SIZE", "1024"))      # quizzes kept in memory per worker
+
+class QuizStore:
+    """
+    SQLite (WAL) table of quizzes with an in-process LRU in front for reads. Quizzes are
+    immutable once saved, so cached copies never go stale; expired rows are deleted on writes,
+    at most once per `cleanup_every` seconds.
+    """
+    def __init__(self, path: str, ttl: float = QUIZ_TTL, cache_size: int = QUIZ_CACHE_SIZE,
+                 cleanup_every: float = 600):
+        self.ttl, self.cleanup_every = ttl, cleanup_every
+        self._cache = TTLCache(cache_size, ttl)
+        self._cleaned = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS quizzes (quiz_id TEXT PRIMARY KEY, owner TEXT NOT NULL, "
+                         "items TEXT NOT NULL, created REAL NOT NULL, expires REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS quizzes_expires ON quizzes(expires)")
+
+    def save(self, quiz_id: str, owner: str, items: List[Dict], ttl: Optional[float] = None):
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO quizzes(quiz_id, owner, items, created, expires) VALUES (?,?,?,?,?)",
+                             (quiz_id, owner, json.dumps(items), now, expires))
+        self._cache.put(quiz_id, (owner, items), ttl=expires - now)
+        if now - self._cleaned >= self.cleanup_every:
+            self.cleanup()
+
+    def get(self, quiz_id: str, owner: str) -> Optional[List[Dict]]:
+        # None for unknown, expired and other users' quizzes alike
+        hit = self._cache.get(quiz_id)
+        if hit is None:
+            with self._lock:
+                row = self._db.execute("SELECT owner, items, expires FROM quizzes WHERE quiz_id=? AND expires>?",
+                                       (quiz_id, time.time())).fetchone()
+            if row is None:
+                return None
+            hit = (row[0], json.loads(row[1]))
+            self._cache.put(quiz_id, hit, ttl=row[2] - time.time())
+        return hit[1] if hit[0] == owner else None
+
+    def cleanup(self) -> int:
+        self._cleaned = time.time()
+        with self._lock:
+            return self._db.execute("DELETE FROM quizzes WHERE expires<=?", (self._cleaned,)).rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            n, = self._db.execute("SELECT COUNT(*) FROM quizzes").fetchone()
+        return {"quizzes": n, "cache": self._cache.stats()}
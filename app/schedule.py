@@ -1,12 +1,29 @@
-import os, uuid, datetime as dt
-from typing import List, Optional
+import os, re, hashlib, datetime as dt
+from itertools import islice
+from typing import List, Optional, NamedTuple, Iterator, Tuple, Dict
 from dateutil import tz
+from dateutil.rrule import rrulestr
 from ics import Calendar, Event
-
-DOWNLOAD_DIR = os.path.join(os.getcwd(), "downloads")
-os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+from ics.grammar.parse import ContentLine, Container
+from ics.attendee import Attendee
+from .artifacts import artifacts, content_name
+from . import metrics
 
 WEEKMAP = {"Mon":0,"Tue":1,"Wed":2,"Thu":3,"Fri":4,"Sat":5,"Sun":6}
+BYDAY = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+SCHEDULE_PREVIEW_MAX = int(os.getenv("SCHEDULE_PREVIEW_MAX", "100"))  # occurrences listed per preview
+
+class Series(NamedTuple):
+    # one calendar entry: a single event, or the first occurrence of a recurring one
+    start: dt.datetime
+    end: dt.datetime
+    title: str
+    rrule: Optional[str] = None       # RFC 5545 RRULE value, e.g. "FREQ=WEEKLY;BYDAY=MO,TH;UNTIL=..."
+    tzid: Optional[str] = None        # IANA zone the recurrence follows (keeps 19:00 local across DST)
+    description: str = ""
+    attendees: Tuple[str, ...] = ()
+    quiz_id: str = ""                 # with start and rrule, makes the event's UID
 
 def pick_time_in_window(window: str) -> tuple[int,int]:
     # "19:00-21:00" -> pick center minute
@@ -18,7 +35,7 @@ def pick_time_in_window(window: str) -> tuple[int,int]:
     mid = (start_minutes + end_minutes)//2
     return divmod(mid, 60)  # hour, minute
 
-def gen_events_once(tzname: Optional[str],window: Optional[str],title: str,minutes: int = 10):
+def gen_events_once(tzname: Optional[str],window: Optional[str],title: str,minutes: int = 10) -> List[Series]:
     now = dt.datetime.now(tz=tz.gettz(tzname)) if tzname else dt.datetime.now()
     if window:
         hh, mm = pick_time_in_window(window)
@@ -26,40 +43,115 @@ def gen_events_once(tzname: Optional[str],window: Optional[str],title: str,minut
         if start < now:
             start = start + dt.timedelta(days=1)
     else:
-        start = now + dt.timedelta(minutes=5)
+        start = (now + dt.timedelta(minutes=5)).replace(second=0, microsecond=0)
     end = start + dt.timedelta(minutes=minutes)
-    return [(start, end, title)]
+    return [Series(start, end, title)]
 
-def gen_events_spaced(end_date: str,days: list[str],tzname: Optional[str],window: str,title: str,minutes: int = 10) -> List[tuple]:
+def gen_events_spaced(end_date: str,days: list[str],tzname: Optional[str],window: str,title: str,minutes: int = 10) -> List[Series]:
+    # one weekly recurring event from the first matching day up to end_date, not one event per day
     assert days and window
     localtz = tz.gettz(tzname) if tzname else None
     today = dt.date.today()
     y, m, d = map(int, end_date.split("-"))
     until = dt.date(y, m, d)
 
+    weekdays = sorted({WEEKMAP[d] for d in days})
+    first = today + dt.timedelta(days=min((wd - today.weekday()) % 7 for wd in weekdays))
+    if first > until:
+        return []
     hh, mm = pick_time_in_window(window)
-    events = []
-    cur = today
-    while cur <= until:
-        if cur.weekday() in [WEEKMAP[d] for d in days]:
-            start = dt.datetime(cur.year, cur.month, cur.day, hh, mm)
-            if localtz: start = start.replace(tzinfo=localtz)
-            end = start + dt.timedelta(minutes=minutes)
-            events.append((start, end, title))
-        cur += dt.timedelta(days=1)
-    return events
+    start = dt.datetime(first.year, first.month, first.day, hh, mm, tzinfo=localtz)
+    last = dt.datetime(until.year, until.month, until.day, 23, 59, 59, tzinfo=localtz)
+    if localtz: last = last.astimezone(tz.UTC)  # UNTIL is UTC whenever DTSTART carries a zone
+    rule = f"FREQ=WEEKLY;BYDAY={','.join(BYDAY[wd] for wd in weekdays)};UNTIL={last:%Y%m%dT%H%M%S}Z"
+    return [Series(start, start + dt.timedelta(minutes=minutes), title, rule, tzname if localtz else None)]
+
+def occurrences(series: List[Series], limit: Optional[int] = None) -> Iterator[Series]:
+    """Each event's occurrences in order, series after series; recurrences are expanded lazily."""
+    def expand():
+        for s in series:
+            if not s.rrule:
+                yield s
+                continue
+            # dateutil wants a naive UNTIL for a naive start
+            rule = s.rrule if s.start.tzinfo else s.rrule.rstrip("Z")
+            length = s.end - s.start
+            for start in rrulestr(rule, dtstart=s.start):
+                yield s._replace(start=start, end=start + length, rrule=None)
+    return islice(expand(), limit)
+
+def _local(ts: dt.datetime) -> str:
+    return f"{ts:%Y%m%dT%H%M%S}"
+
+def _utc_offset(d: dt.timedelta) -> str:
+    m = int(d.total_seconds()) // 60
+    return f"{'-' if m < 0 else '+'}{abs(m) // 60:02d}{abs(m) % 60:02d}"
+
+def _vtimezone(tzid: str, begin: dt.datetime, until: dt.datetime) -> Container:
+    """
+    VTIMEZONE for `tzid` from `begin` to `until`: one observance for the offset in force at
+    `begin`, then one per UTC-offset change in between, found by stepping a week at a time
+    and bisecting to the minute.
+    """
+    zone = tz.gettz(tzid)
+    def off(t: dt.datetime) -> dt.timedelta:
+        return t.astimezone(zone).utcoffset()
+    def observance(at: dt.datetime, before: dt.timedelta) -> Container:
+        local = at.astimezone(zone)
+        return Container("DAYLIGHT" if local.dst() else "STANDARD",
+                         ContentLine("DTSTART", value=_local((at + before).replace(tzinfo=None))),
+                         ContentLine("TZOFFSETFROM", value=_utc_offset(before)),
+                         ContentLine("TZOFFSETTO", value=_utc_offset(local.utcoffset())),
+                         ContentLine("TZNAME", value=local.tzname()))
+    t = begin.astimezone(tz.UTC)
+    out = Container("VTIMEZONE", ContentLine("TZID", value=tzid), observance(t, off(t)))
+    while t < until:
+        nxt = min(t + dt.timedelta(days=7), until)
+        if off(nxt) != off(t):
+            a, b = 0, -(-int((nxt - t).total_seconds()) // 60)  # offset at t+a min is off(t), at t+b it isn't
+            while b - a > 1:
+                m = (a + b) // 2
+                if off(t + dt.timedelta(minutes=m)) == off(t): a = m
+                else: b = m
+            out.append(observance(t + dt.timedelta(minutes=b), off(t)))
+        t = nxt
+    return out
 
-def write_ics(events: List[tuple], name_hint: str, description: str = "") -> str:
+def write_ics(events: List[Series], name_hint: str, description: str = "") -> str:
     cal = Calendar()
-    for (start, end, title) in events:
-        ev = Event()
-        ev.name = title
-        ev.begin = start
-        ev.end = end
-        ev.description = description
+    for s in events:
+        # a stable UID (ics picks a random one): the same schedule writes the same file, so it is
+        # stored once, and a calendar re-importing it updates the event instead of duplicating it
+        key = f"{s.quiz_id}|{s.start.isoformat()}|{s.rrule or ''}"
+        ev = Event(uid=f"{hashlib.sha1(key.encode('utf-8')).hexdigest()[:32]}@study-mcp")
+        ev.name = s.title
+        if s.rrule and s.tzid:
+            # ics writes times as UTC, which would drift an hour across DST; zoned recurring
+            # events carry local times with a TZID, defined by a VTIMEZONE below
+            ev.extra.append(ContentLine("DTSTART", {"TZID": [s.tzid]}, _local(s.start)))
+            ev.extra.append(ContentLine("DTEND", {"TZID": [s.tzid]}, _local(s.end)))
+        else:
+            ev.begin = s.start
+            ev.end = s.end
+        if s.rrule:
+            ev.extra.append(ContentLine("RRULE", value=s.rrule))
+        ev.description = s.description or description
+        for email in s.attendees:
+            ev.add_attendee(Attendee(email))
         cal.events.add(ev)
-    stem = f"{name_hint}-{uuid.uuid4().hex[:8]}.ics"
-    path = os.path.join(DOWNLOAD_DIR, stem)
-    with open(path, "w", encoding="utf-8") as f:
-        f.writelines(cal)
-    return path
+    # zoned series need their zone defined in the file: the span each zone has to cover
+    spans: Dict[str, Tuple[dt.datetime, dt.datetime]] = {}
+    for s in events:
+        if not (s.rrule and s.tzid): continue
+        m = re.search(r"UNTIL=(\d{8}T\d{6})Z", s.rrule)
+        until = dt.datetime.strptime(m.group(1), "%Y%m%dT%H%M%S").replace(tzinfo=tz.UTC) if m else s.end
+        a, b = spans.get(s.tzid, (s.start, until))
+        spans[s.tzid] = (min(a, s.start), max(b, until))
+    with metrics.stage("ics_write"):
+        text = "".join(cal)
+        if spans:
+            # components follow the calendar properties, so the zones go just before the first event
+            i = text.index("BEGIN:VEVENT")
+            text = text[:i] + "".join(f"{_vtimezone(z, a, b)}\r\n" for z, (a, b) in sorted(spans.items())) + text[i:]
+        name = artifacts.put(content_name(text, name_hint, "ics"), text)
+    return artifacts.path(name)
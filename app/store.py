@@ -1,60 +1,393 @@
+import os, json, fcntl, threading, logging
 import faiss, numpy as np
-from typing import List, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Optional, Set, Iterable
+from . import ann, metrics
 from .ingestion import Chunk
-from .embeddings import embed_texts
+from .embeddings import embed_texts, embed_query, embed_queries
+
+log = logging.getLogger(__name__)
+
+STORE_DIR = os.getenv("STORE_DIR", os.path.join(os.getcwd(), "data", "store"))
+CORPORA_DIR = os.path.join(STORE_DIR, "_corpora")
+os.makedirs(CORPORA_DIR, exist_ok=True)
+
+# one record per chunk in rows.bin; text lives in text.bin at [off, off+len)
+ROW_DTYPE = np.dtype([("off", "<i8"), ("len", "<i4"), ("src", "<i4"), ("ord", "<i4")])
+
+def _write_json(path: str, obj):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(obj, f)
+    os.replace(path + ".tmp", path)
+
+# ANN (re)builds run here, one at a time, off the request path
+_ann_builder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ann-build")
+
+class _Partition:
+    """
+    On-disk snapshot of one file's chunks, appended to on every add:
+      vectors.f32  raw float32 rows (normalized embeddings)
+      text.bin     utf-8 chunk texts, concatenated
+      rows.bin     ROW_DTYPE records pointing into text.bin
+      meta.json    {"dim", "count", "sources"}; rewritten last, so a torn append is ignored
+      ann.*.faiss  optional approximate and/or compressed (VECTOR_CODEC) index over rows
+                   [0, ann.json "count"), see app/ann.py
+    Everything is read back through mmap, so RSS does not grow with corpus size
+    and several workers share the same pages.
+    """
+    def __init__(self, key: str, slot: int):
+        self.key = key
+        self.slot = slot
+        self.dir = os.path.join(STORE_DIR, key)
+        self.dim: Optional[int] = None
+        self.count = 0
+        self.sources: Set[int] = set()  # every page/slide already ingested, including empty ones
+        self.vecs = self.rows = self.text = None
+        self.order = self.src_sorted = np.zeros(0, dtype="int64")
+        self.src_ids, self.src_start = np.zeros(0, dtype="int32"), np.zeros(1, dtype="int64")
+        self.ann: Optional[faiss.Index] = None
+        self.ann_kind, self.ann_codec, self.ann_count, self.ann_trained = "flat", "none", 0, 0
+        self._stamp = self._ann_stamp = None
+        self._building = False
+        self.refresh()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def refresh(self):
+        # pick up appends made by other workers since we last mapped the files
+        try:
+            st = os.stat(self._path("meta.json"))
+        except FileNotFoundError:
+            return
+        # meta.json is replaced, never rewritten in place, so the inode changes on every commit
+        stamp = (st.st_ino, st.st_mtime_ns)
+        if stamp == self._stamp: return
+        with open(self._path("meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        dim, count = meta["dim"], meta["count"]
+        if count:
+            # map first, publish after, so concurrent readers never see count > mapped rows
+            vecs = np.memmap(self._path("vectors.f32"), dtype="float32", mode="r", shape=(count, dim))
+            rows = np.memmap(self._path("rows.bin"), dtype=ROW_DTYPE, mode="r", shape=(count,))
+            text = np.memmap(self._path("text.bin"), dtype="uint8", mode="r")
+            # rows are stored in ingestion order; keep a by-source permutation for range lookups
+            # (stable, so a source's rows stay in chunk order) and where each source starts in it
+            order = np.argsort(rows["src"], kind="stable")
+            src_sorted = np.asarray(rows["src"])[order]
+            src_ids, src_start = np.unique(src_sorted, return_index=True)
+            self.vecs, self.rows, self.text = vecs, rows, text
+            self.order, self.src_sorted = order, src_sorted
+            self.src_ids, self.src_start = src_ids, np.append(src_start, count)
+        self.sources = set(meta.get("sources") or np.unique(self.src_sorted).tolist())
+        self.dim, self.count, self._stamp = dim, count, stamp
+        self._refresh_ann()
+        self._schedule_ann()
+
+    def _refresh_ann(self):
+        try:
+            st = os.stat(self._path("ann.json"))
+        except FileNotFoundError:
+            return
+        stamp = (st.st_ino, st.st_mtime_ns)
+        if stamp == self._ann_stamp: return
+        with open(self._path("ann.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        index = ann.read(self._path(meta["file"]))
+        self.ann, self.ann_kind, self.ann_count, self.ann_trained = index, meta["kind"], meta["count"], meta["trained"]
+        self.ann_codec = meta.get("codec", "none")
+        self._ann_stamp = stamp
+
+    def _schedule_ann(self):
+        # pick the index type for the current size; (re)build in the background when it changes,
+        # or when enough rows arrived since the last build. Searches stay exact until then.
+        kind = ann.choose_kind(self.count)
+        if kind == "flat" and self.ann is not None: kind = self.ann_kind  # don't downgrade an existing index
+        elif not ann.needs_index(kind, n=self.count): return
+        tail = self.count - self.ann_count
+        if (kind == self.ann_kind and self.ann_codec == ann.VECTOR_CODEC
+                and tail <= max(256, ann.ANN_CATCHUP * self.ann_count)): return
+        if self._building: return
+        self._building = True
+        _ann_builder.submit(self._build_ann, kind)
+
+    def _build_ann(self, kind: str):
+        try:
+            with open(self._path(".ann.lock"), "w") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return  # another worker is building; we pick its index up on refresh
+                self._refresh_ann()
+                n, vecs, codec = self.count, self.vecs, ann.VECTOR_CODEC
+                if (kind == self.ann_kind and codec == self.ann_codec and self.ann is not None
+                        and not ann.needs_retrain(kind, self.ann_trained, n, codec)):
+                    with metrics.stage("ann_extend", kind=kind):
+                        index, trained = ann.extend(self._path(f"ann.{kind}.faiss"), vecs, self.ann_count, n), self.ann_trained
+                else:
+                    with metrics.stage("ann_build", kind=kind):
+                        index, trained = ann.build(kind, vecs, n, codec), n
+                fname = f"ann.{kind}.faiss"
+                faiss.write_index(index, self._path(fname + ".tmp"))
+                os.replace(self._path(fname + ".tmp"), self._path(fname))
+                _write_json(self._path("ann.json"), {"kind": kind, "codec": codec, "count": n,
+                                                     "trained": trained, "file": fname})
+                for other in ann.KINDS:
+                    if other != kind and os.path.exists(self._path(f"ann.{other}.faiss")):
+                        os.remove(self._path(f"ann.{other}.faiss"))
+                self._refresh_ann()
+                log.info("built %s/%s index for %s over %d vectors (%.1f bytes/vector)",
+                         kind, codec, self.key, n, ann.bytes_per_vector(index))
+        except Exception:
+            log.exception("ANN build failed for %s", self.key)
+        finally:
+            self._building = False
+
+    def append(self, chunks: List[Chunk], vecs: np.ndarray, sources: Iterable[int]):
+        os.makedirs(self.dir, exist_ok=True)
+        with open(self._path(".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._stamp = None
+            self.refresh()  # another worker may have appended in the meantime
+            # a concurrent load of the same file may have beaten us to some pages
+            new_sources = set(sources) - self.sources
+            if not new_sources: return
+            keep = [i for i, c in enumerate(chunks) if int(c.source_id) in new_sources]
+            chunks, vecs = [chunks[i] for i in keep], vecs[keep]
+            if chunks and self.dim and self.dim != vecs.shape[1]:
+                raise ValueError(f"embedding dim {vecs.shape[1]} != stored dim {self.dim}")
+            rows = np.zeros(len(chunks), dtype=ROW_DTYPE)
+            with open(self._path("text.bin"), "ab") as f:
+                # truncate anything past the last committed row (torn write)
+                off = int(self.rows[-1]["off"] + self.rows[-1]["len"]) if self.count else 0
+                f.truncate(off)
+                for r, c in zip(rows, chunks):
+                    b = c.text.encode("utf-8")
+                    f.write(b)
+                    r["off"], r["len"] = off, len(b)
+                    r["src"], r["ord"] = int(c.source_id), int(c.uid.rsplit(":", 1)[1])
+                    off += len(b)
+            dim = self.dim or (vecs.shape[1] if chunks else 0)
+            for name, arr, width in (("rows.bin", rows, ROW_DTYPE.itemsize),
+                                     ("vectors.f32", np.ascontiguousarray(vecs, dtype="float32"), 4 * dim)):
+                with open(self._path(name), "ab") as f:
+                    f.truncate(self.count * width)
+                    f.write(arr.tobytes())
+            _write_json(self._path("meta.json"), {"dim": int(dim), "count": self.count + len(chunks),
+                                                  "sources": sorted(self.sources | new_sources)})
+            self._stamp = None
+            self.refresh()
+
+    def rows_in_range(self, start: int, end: int) -> np.ndarray:
+        lo = np.searchsorted(self.src_sorted, start, "left")
+        hi = np.searchsorted(self.src_sorted, end, "right")
+        return self.order[lo:hi]
+
+    def source_span(self, start: int, end: int) -> Tuple[int, int]:
+        # [a, b) into src_ids for the sources with chunks in [start, end]
+        return int(np.searchsorted(self.src_ids, start, "left")), int(np.searchsorted(self.src_ids, end, "right"))
+
+    def sample_rows(self, start: int, end: int, max_per_source: int, max_total: int) -> np.ndarray:
+        # the first max_per_source rows of each source in [start, end], in source order, up to
+        # max_total; only the sources that contribute are visited
+        a, b = self.source_span(start, end)
+        out, left = [], max_total
+        for i in range(a, b):
+            if left <= 0: break
+            lo = int(self.src_start[i])
+            take = min(max_per_source, int(self.src_start[i + 1]) - lo, left)
+            out.append(self.order[lo:lo + take])
+            left -= take
+        return np.concatenate(out) if out else np.zeros(0, dtype="int64")
+
+    def chunks(self, rows: np.ndarray) -> List[Chunk]:
+        # one gather from the row table, then each text is sliced out of the mapped buffer;
+        # nothing is decoded for rows that are not asked for
+        recs = self.rows[np.asarray(rows, dtype="int64")]
+        text = self.text
+        return [Chunk(uid=f"{self.key}:{src}:{o}", source_id=str(src), text=text[off:off+n].tobytes().decode("utf-8"))
+                for off, n, src, o in zip(recs["off"].tolist(), recs["len"].tolist(),
+                                          recs["src"].tolist(), recs["ord"].tolist())]
+
+    def chunk(self, row: int) -> Chunk:
+        return self.chunks([row])[0]
+
+    def _exact(self, qv: np.ndarray, k: int, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        # exact inner-product scan; straight over the mmapped vectors when the range is the whole file
+        if len(rows) == self.count:
+            return faiss.knn(qv, self.vecs, min(k, self.count), faiss.METRIC_INNER_PRODUCT)
+        rows = np.sort(rows)
+        D, I = faiss.knn(qv, np.ascontiguousarray(self.vecs[rows]), min(k, len(rows)), faiss.METRIC_INNER_PRODUCT)
+        return D, np.where(I >= 0, rows[np.maximum(I, 0)], -1)
+
+    def search(self, qv: np.ndarray, k: int, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        index, kind, codec, covered = self.ann, self.ann_kind, self.ann_codec, self.ann_count
+        indexed = rows[rows < covered]
+        fraction = len(indexed) / max(covered, 1)
+        # small ranges, and ranges that are a small part of the file (the ID filter would throw
+        # away most of what HNSW/IVF visit), are scanned exactly; a compressed flat index is
+        # always used, since saving memory is its whole point
+        if index is None or (kind != "flat" and (len(rows) < ann.ANN_HNSW_MIN or fraction < ann.ANN_FILTER_MIN)):
+            return self._exact(qv, k, rows)
+        sel, wide = None, {}
+        if len(rows) != self.count:
+            sel, wide = faiss.IDSelectorBatch(indexed.astype("int64")), ann.filtered(index, kind, fraction)
+        # lossy codes only shortlist; the shortlist is re-scored against the float32 rows
+        rerank = ann.is_lossy(kind, codec) and ann.VECTOR_RERANK > 1
+        D, I = index.search(qv, k * ann.VECTOR_RERANK if rerank else k, params=ann.params(kind, sel, **wide))
+        if rerank:
+            D, I = ann.rescore(qv, I, self.vecs, k)
+        tail = rows[rows >= covered]
+        if not len(tail):
+            return D, I
+        # rows appended since the last build are scanned exactly and merged in
+        D2, I2 = self._exact(qv, k, tail)
+        D, I = np.hstack([D, D2]), np.hstack([I, I2])
+        top = np.argsort(-D, axis=1)[:, :k]
+        return np.take_along_axis(D, top, 1), np.take_along_axis(I, top, 1)
 
 class VectorStore:
     def __init__(self):
-        self.index=None
-        self.id2chunk: Dict[int, Chunk] = {}
-        self.next_id=0
-        self.dim = None
+        # one partition per source file; a corpus is a page/slide range of a file, so searches
+        # only scan the target range. chunk ids are process-local: (partition slot << 32) | row
+        self.partitions: Dict[str, _Partition] = {}
+        self.slots: List[_Partition] = []
+        self.corpora: Dict[str, Tuple[str, int, int]] = {}
+        self._lock = threading.Lock()
+        # partitions are opened (and mapped) on first use, not at startup
+
+    def _partition(self, key: str, create: bool = False) -> Optional[_Partition]:
+        p = self.partitions.get(key)
+        if p is not None:
+            p.refresh()
+            return p
+        # another worker may have created it
+        if not create and not os.path.isfile(os.path.join(STORE_DIR, key, "meta.json")):
+            return None
+        with self._lock:
+            p = self.partitions.get(key)
+            if p is None:
+                p = _Partition(key, len(self.slots))
+                self.slots.append(p)
+                self.partitions[key] = p
+        return p
 
-    def _ensure(self, d:int):
-        if self.index is None:
-            self.index = faiss.IndexFlatIP(d)
-            self.dim = d
+    def _corpus_ref(self, corpus_id: str) -> Optional[Tuple[_Partition, int, int]]:
+        ref = self.corpora.get(corpus_id)
+        if ref is None:
+            if not corpus_id.isalnum(): return None
+            path = os.path.join(CORPORA_DIR, f"{corpus_id}.json")
+            if os.path.isfile(path):
+                with open(path, encoding="utf-8") as f:
+                    js = json.load(f)
+                ref = (js["file"], js["start"], js["end"])
+            else:
+                return None
+            self.corpora[corpus_id] = ref
+        p = self._partition(ref[0])
+        if p is None or p.count == 0: return None
+        return p, ref[1], ref[2]
 
-    def add_corpus(self, corpus_id: str, chunks: List[Chunk]):
+    def _corpus(self, corpus_id: str) -> Optional[Tuple[_Partition, np.ndarray]]:
+        ref = self._corpus_ref(corpus_id)
+        if ref is None: return None
+        p, start, end = ref
+        rows = p.rows_in_range(start, end)
+        return (p, rows) if len(rows) else None
+
+    def indexed_sources(self, file_key: str) -> Set[int]:
+        p = self._partition(file_key)
+        return set(p.sources) if p else set()
+
+    def add_file_chunks(self, file_key: str, sources: Iterable[int], chunks: List[Chunk]):
+        # sources are recorded even when they produced no chunks, so they are not re-extracted
         texts=[c.text for c in chunks]
-        vecs=embed_texts(texts)
-        self._ensure(vecs.shape[1])
-        ids=np.arange(self.next_id, self.next_id+len(chunks))
-        self.next_id += len(chunks)
-        self.index.add(vecs)
-        for i,c in zip(ids,chunks):
-            self.id2chunk[int(i)] = c
+        vecs=embed_texts(texts) if texts else np.zeros((0, 0), dtype="float32")
+        with metrics.stage("store_append"):
+            self._partition(file_key, create=True).append(chunks, vecs, sources)
+
+    def register_corpus(self, corpus_id: str, file_key: str, start: int, end: int):
+        if self.corpora.get(corpus_id) == (file_key, start, end): return
+        _write_json(os.path.join(CORPORA_DIR, f"{corpus_id}.json"), {"file": file_key, "start": start, "end": end})
+        self.corpora[corpus_id] = (file_key, start, end)
+
+    def corpus_sources(self, corpus_id: str) -> Tuple[int, List[str]]:
+        # (chunk count, sorted source ids) for a registered corpus
+        ref = self._corpus_ref(corpus_id)
+        if ref is None: return 0, []
+        p, start, end = ref
+        a, b = p.source_span(start, end)
+        return int(p.src_start[b] - p.src_start[a]), [str(int(s)) for s in p.src_ids[a:b]]
 
     def search(self, query: str, corpus_id: str, k: int = 8) -> List[Tuple[int,float]]:
-        if self.index is None: return []
-        qv = embed_texts([query])
-        D, I = self.index.search(qv, min(k*6, len(self.id2chunk)))  # overfetch
-        hits=[]
-        for idx, score in zip(I[0], D[0]):
-            if idx == -1: continue
-            ch = self.id2chunk.get(int(idx))
-            if ch and ch.uid.startswith(corpus_id + ":"):
-                hits.append((int(idx), float(score)))
-            if len(hits) >= k: break
-        return hits
+        c = self._corpus(corpus_id)
+        if c is None: return []
+        return self._hits(c, embed_query(query), k)[0]
+
+    def search_many(self, queries: List[str], corpus_id: str, k: int = 8) -> List[List[Tuple[int,float]]]:
+        # one embedding pass and one faiss search over the whole query matrix; hits per query, in order
+        c = self._corpus(corpus_id)
+        if c is None or not queries: return [[] for _ in queries]
+        return self._hits(c, embed_queries(queries), k)
+
+    def _hits(self, c: Tuple[_Partition, np.ndarray], qv: np.ndarray, k: int) -> List[List[Tuple[int,float]]]:
+        p, rows = c
+        with metrics.stage("search", kind=p.ann_kind if p.ann is not None else "exact"):
+            D, I = p.search(qv, k, rows)
+        metrics.inc("queries_searched", len(qv))
+        base = p.slot << 32
+        return [[(base | int(idx), float(score)) for idx, score in zip(ii, dd) if idx != -1]
+                for ii, dd in zip(I.tolist(), D.tolist())]
+
+    def file_keys(self) -> List[str]:
+        # every partition on disk, opened or not
+        return sorted(n for n in os.listdir(STORE_DIR) if os.path.isfile(os.path.join(STORE_DIR, n, "meta.json")))
+
+    def stats(self) -> dict:
+        # partitions on disk, and of those the ones this worker has opened; vectors and bytes
+        # (vectors, rows, text and ANN index files) are for the open ones
+        size = 0
+        for p in self.slots:
+            if os.path.isdir(p.dir):
+                size += sum(e.stat().st_size for e in os.scandir(p.dir) if e.is_file())
+        return {"partitions": len(self.file_keys()), "partitions_open": len(self.slots), "vectors": sum(p.count for p in self.slots),
+                "corpora": sum(1 for n in os.listdir(CORPORA_DIR) if n.endswith(".json")), "bytes": size}
+
+    def _by_slot(self, ids: List[int]) -> Dict[int, List[Tuple[int, int]]]:
+        # (position, row) per partition, skipping ids that don't resolve
+        groups: Dict[int, List[Tuple[int, int]]] = {}
+        for pos, i in enumerate(ids):
+            slot, row = i >> 32, i & 0xFFFFFFFF
+            if slot < len(self.slots) and row < self.slots[slot].count:
+                groups.setdefault(slot, []).append((pos, row))
+        return groups
+
+    def get_vectors(self, ids: List[int]) -> np.ndarray:
+        # stored (normalized) embeddings for chunk ids, e.g. for MMR in the context packer
+        groups = self._by_slot(ids)
+        dim = next((self.slots[s].dim for s in groups), 0) or 0
+        out = np.zeros((len(ids), dim), dtype="float32")
+        for slot, pr in groups.items():
+            pos, rows = zip(*pr)
+            out[list(pos)] = self.slots[slot].vecs[list(rows)]
+        return out
 
     def get_chunks(self, ids: List[int]) -> List[Chunk]:
-        return [self.id2chunk[i] for i in ids if i in self.id2chunk]
-   
-   
+        # in the order asked for; unknown ids are dropped
+        placed: Dict[int, Chunk] = {}
+        for slot, pr in self._by_slot(ids).items():
+            pos, rows = zip(*pr)
+            placed.update(zip(pos, self.slots[slot].chunks(np.array(rows))))
+        return [placed[k] for k in sorted(placed)]
+
+
     def all_chunks_for_corpus(self, corpus_id: str, max_per_source: int = 5, max_total: int = 30):
-        # gather chunks belonging to corpus_id, lightly balanced across source_ids
-        items = [c for c in self.id2chunk.values() if c.uid.startswith(corpus_id + ":")]
-        # group by source_id
-        from collections import defaultdict
-        buckets = defaultdict(list)
-        for c in items:
-            buckets[c.source_id].append(c)
-        # take up to max_per_source from each, then cap total
-        snippets = []
-        for sid in sorted(buckets, key=lambda x: int(x)):
-            for c in buckets[sid][:max_per_source]:
-                snippets.append({"source_id": c.source_id, "text": c.text})
-                if len(snippets) >= max_total:
-                    return snippets
-        return snippets[:max_total]
\ No newline at end of file
+        # gather chunks belonging to corpus_id, lightly balanced across source_ids:
+        # up to max_per_source from each source in order, then cap total
+        ref = self._corpus_ref(corpus_id)
+        if ref is None: return []
+        p, start, end = ref
+        rows = p.sample_rows(start, end, max_per_source, max_total)
+        ords, vecs = p.rows["ord"][rows].tolist(), np.asarray(p.vecs[rows], dtype="float32")
+        return [{"source_id": ch.source_id, "text": ch.text, "ord": o, "vec": v}
+                for ch, o, v in zip(p.chunks(rows), ords, vecs)]
@@ -1,5 +1,5 @@
 import re, hashlib
-from typing import Tuple
+from typing import Tuple, List, Iterable
 
 RANGE_RE = re.compile(r"(slides|pages)\s+(\d+)\s*-\s*(\d+)", re.I)
 
@@ -12,3 +12,14 @@ def parse_range(s: str) -> Tuple[str,int,int]:
 
 def md5_hex(s: str) -> str:
     return hashlib.md5(s.encode("utf-8")).hexdigest()
+
+
+def missing_runs(start: int, end: int, have: Iterable[int]) -> List[Tuple[int,int]]:
+    # contiguous [a, b] runs of start..end that are not in `have`: the gaps between the sorted
+    # indexed pages, so the cost follows what is indexed, not the width of the range
+    runs, a = [], start
+    for i in sorted(x for x in have if start <= x <= end):
+        if i > a: runs.append((a, i-1))
+        a = i+1
+    if a <= end: runs.append((a, end))
+    return runs
@@ -0,0 +1,26 @@
+# Recall@k vs. latency of the ANN index types against exact search, over a stored partition.
+#   python -m scripts.ann_report [file_key] [--kind flat|hnsw|ivf_flat|ivf_pq] [--codec none|fp16|sq8|pq]
+#                                [--k 10] [--queries 200]
+# Use the nprobe / efSearch that reaches the recall you need as ANN_NPROBE / ANN_EF_SEARCH, and the
+# codec whose bytes/vector and (re-scored) recall you can live with as VECTOR_CODEC.
+import argparse, json
+from app import ann
+from app.store import VectorStore
+
+ap = argparse.ArgumentParser()
+ap.add_argument("file_key", nargs="?", help="partition to test (default: the largest)")
+ap.add_argument("--kind", action="append", choices=ann.KINDS, help="repeatable; default: all ANN types")
+ap.add_argument("--codec", action="append", choices=ann.CODECS, help="repeatable; default: VECTOR_CODEC")
+ap.add_argument("--k", type=int, default=10)
+ap.add_argument("--queries", type=int, default=200)
+args = ap.parse_args()
+
+store = VectorStore()
+parts = [p for p in map(store._partition, [args.file_key] if args.file_key else store.file_keys()) if p and p.count]
+if not parts: raise SystemExit("no indexed material in STORE_DIR")
+p = max(parts, key=lambda x: x.count)
+print(json.dumps({"file_key": p.key, "current_index": p.ann_kind, "current_codec": p.ann_codec, "reports": [
+    ann.recall_report(p.vecs, p.count, kind, k=args.k, n_queries=args.queries, codec=codec)
+    for kind in (args.kind or ann.KINDS[1:]) for codec in (args.codec or [ann.VECTOR_CODEC])
+    if ann.needs_index(kind, codec, p.count)
+]}, indent=2))
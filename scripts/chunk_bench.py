@@ -0,0 +1,45 @@
+# Chunker micro-benchmark: the previous word-list split_text against chunk_spans, on synthetic pages.
+#   python -m scripts.chunk_bench [--chars 2000 20000 200000] [--repeat 3]
+import argparse, json, random, time
+from app.ingestion import chunk_spans
+
+def split_text_old(text: str, max_len=800, overlap=80):
+    # the implementation chunk_spans replaced: re-sums the chunk after every word
+    if not text: return []
+    words=text.split(); out=[]; cur=[]
+    for w in words:
+        cur.append(w)
+        if sum(len(x)+1 for x in cur) > max_len:
+            out.append(" ".join(cur[:-1]))
+            cur = cur[-overlap:] if overlap < len(cur) else cur
+    if cur: out.append(" ".join(cur))
+    return out
+
+def page(n_chars: int, rng: random.Random) -> str:
+    words, size = [], 0
+    while size < n_chars:
+        w = "".join(rng.choice("etaoinshrdlucmfwyp") for _ in range(rng.randint(1, 12)))
+        words.append(w + ("\n" if rng.random() < 0.05 else ""))
+        size += len(w) + 1
+    return " ".join(words)
+
+def best_ms(fn, text: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(text); best = min(best, time.perf_counter() - t0)
+    return round(best * 1000, 3)
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--chars", type=int, nargs="+", default=[2000, 20000, 200000])
+ap.add_argument("--repeat", type=int, default=3)
+args = ap.parse_args()
+
+rng = random.Random(0)
+rows = []
+for n in args.chars:
+    text = page(n, rng)
+    old_ms = best_ms(split_text_old, text, args.repeat)
+    new_ms = best_ms(chunk_spans, text, args.repeat)
+    rows.append({"chars": len(text), "chunks_old": len(split_text_old(text)), "chunks_new": len(chunk_spans(text)),
+                 "old_ms": old_ms, "new_ms": new_ms, "speedup": round(old_ms / max(new_ms, 1e-6), 1)})
+print(json.dumps(rows, indent=2))
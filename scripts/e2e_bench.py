@@ -0,0 +1,288 @@
+# End-to-end benchmark through the FastAPI app, fully offline: synthetic PDF/PPTX/DOCX files, a
+# stand-in for the Descope session check and a fake OpenAI client, each with a fixed latency.
+# Extraction, chunking, embeddings, faiss, PDF rendering and the stores are the real code paths.
+#   python -m scripts.e2e_bench [--pages 40] [--concurrency 8] [--requests 40] [--llm-ms 300]
+#                               [--out bench.json] [--baseline old.json --tolerance 0.15]
+# Everything is written under a fresh temp dir (or --workdir, which is kept), so runs start cold
+# and are comparable. The embedding model must already be in the local model cache. With
+# --baseline, scenarios whose p95 or throughput got worse by more than --tolerance are listed
+# under "regressions" and the exit code is 1.
+import argparse, asyncio, json, math, os, random, re, resource, shutil, subprocess, sys, tempfile, time
+from types import SimpleNamespace
+
+WORDS = ("gradient descent loss function matrix vector eigenvalue basis probability sample variance "
+         "kernel regression cluster entropy prior posterior likelihood estimator bias tree graph "
+         "partition index query cache latency throughput shard replica consensus").split()
+
+def sentence(rng: random.Random, n: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+def make_pdf(path: str, pages: int, words: int, rng: random.Random):
+    import fitz
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        text = f"Lecture page {i + 1}\n" + "\n".join(sentence(rng, 12) for _ in range(max(words // 12, 1)))
+        page.insert_textbox(page.rect + (50, 50, -50, -50), text, fontsize=9)
+    doc.save(path)
+
+def make_pptx(path: str, slides: int, words: int, rng: random.Random):
+    from pptx import Presentation
+    prs = Presentation()
+    for i in range(slides):
+        s = prs.slides.add_slide(prs.slide_layouts[1])
+        s.shapes.title.text = f"Slide {i + 1}: {sentence(rng, 4)}"
+        body = s.placeholders[1].text_frame
+        body.text = sentence(rng, 10)
+        for _ in range(max(words // 10 - 1, 0)):
+            body.add_paragraph().text = sentence(rng, 10)
+    prs.save(path)
+
+def make_docx(path: str, pages: int, words: int, rng: random.Random):
+    import docx
+    d = docx.Document()
+    for i in range(pages):
+        d.add_heading(f"Section {i + 1}", level=2)
+        for _ in range(max(words // 40, 1)):
+            d.add_paragraph(" ".join(sentence(rng, 10) for _ in range(4)))
+    d.save(path)
+
+# ---------- stand-ins ----------
+
+def fake_require_user(delay: float):
+    from fastapi import HTTPException
+    def require_user(authorization):
+        time.sleep(delay)
+        if not authorization or not authorization.startswith("Bearer "):
+            raise HTTPException(status_code=401, detail="Missing Authorization")
+        sub = authorization.split(" ", 1)[1].strip()  # the token is the user id
+        return {"subject": sub, "claims": {"sub": sub, "aud": "bench"}}
+    return require_user
+
+def fake_reply(messages: list, llm) -> str:
+    system, user = messages[0]["content"], messages[-1]["content"]
+    srcs = re.findall(r"\((?:src|source) (\d+)\)", user) or ["1"]
+    if system == llm.QUIZ_SYSTEM:
+        n = int((re.search(r"Create (\d+) items", user) or [0, 5])[1])
+        return json.dumps({"items": [{"qtype": "mcq", "question": f"Q{i + 1}: which term fits?",
+                                      "options": ["A", "B", "C", "D"], "answer": "A",
+                                      "source_id": srcs[i % len(srcs)], "rationale": "from the text"}
+                                     for i in range(n)]})
+    if system == llm.NOTES_SYSTEM:
+        # every notes call differs, so each one renders its own PDF
+        rng = random.Random(time.time_ns())
+        heads = ["Outline", "Key Terms", "Formulas", "Examples", "Self-Checks"]
+        return "\n\n".join(f"## {h}\n" + "\n".join(f"- {sentence(rng, 8)} (page {rng.choice(srcs)})" for _ in range(6))
+                           for h in heads)
+    return f"The snippets cover this (page {srcs[0]}); see the cited pages for details."
+
+class FakeCompletions:
+    def __init__(self, delay: float, llm):
+        self.delay, self.llm = delay, llm
+
+    def _response(self, messages):
+        text = fake_reply(messages, self.llm)
+        usage = SimpleNamespace(prompt_tokens=sum(len(m["content"]) for m in messages) // 4,
+                                completion_tokens=len(text) // 4)
+        return text, SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=text))], usage=usage)
+
+    def create(self, model, messages, temperature=None, stream=False):
+        return self._acreate(messages, stream)
+
+    async def _acreate(self, messages, stream):
+        await asyncio.sleep(self.delay)
+        text, resp = self._response(messages)
+        if not stream: return resp
+        async def deltas():
+            for w in re.findall(r"\S+\s*", text):
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=w))])
+        return deltas()
+
+# ---------- driver ----------
+
+def pct(ms: list, p: float) -> float:
+    # nearest rank over sorted latencies
+    return round(ms[max(math.ceil(p / 100 * len(ms)) - 1, 0)], 2) if ms else 0.0
+
+async def run_scenario(name: str, calls: list, concurrency: int) -> dict:
+    """calls: zero-arg coroutine functions returning an httpx response."""
+    sem = asyncio.Semaphore(concurrency)
+    lat, errors = [], []
+    async def one(call):
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                r = await call()
+                ok = r.status_code < 400
+                if not ok: errors.append(f"{r.status_code}: {r.text[:200]}")
+            except Exception as e:
+                ok = False
+                errors.append(f"{type(e).__name__}: {e}")
+            if ok: lat.append((time.perf_counter() - t0) * 1000)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(c) for c in calls))
+    wall = time.perf_counter() - t0
+    lat.sort()
+    out = {"requests": len(calls), "errors": len(errors), "seconds": round(wall, 3),
+           "throughput_rps": round(len(lat) / wall, 2) if wall else 0.0,
+           "mean_ms": round(sum(lat) / len(lat), 2) if lat else 0.0,
+           "p50_ms": pct(lat, 50), "p95_ms": pct(lat, 95), "p99_ms": pct(lat, 99)}
+    if errors: out["first_error"] = errors[0]
+    print(f"{name:>14}: {out['throughput_rps']:8.2f} req/s  p50 {out['p50_ms']:9.2f} ms  "
+          f"p95 {out['p95_ms']:9.2f} ms  errors {out['errors']}", file=sys.stderr)
+    return out
+
+async def bench(args, files: dict) -> dict:
+    import httpx
+    from app import main, llm, metrics
+
+    main.require_user = fake_require_user(args.auth_ms / 1000)
+    llm.aclient = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(args.llm_ms / 1000, llm)))
+
+    rng = random.Random(1)
+    users = [f"bench-user-{i}" for i in range(args.users)]
+    def hdr(i: int) -> dict:
+        return {"Authorization": f"Bearer {users[i % len(users)]}"}
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as c:
+        def post(path, body, i):
+            return lambda: c.post(path, json=body, headers=hdr(i))
+        report = {}
+
+        def load(ftype: str, r: int) -> dict:
+            unit = "slides" if ftype == "pptx" else "pages"
+            return {"file_id": f"bench-{ftype}-{r}", "type": ftype, "range": f"{unit} 1-{args.pages}",
+                    "local_path": files[ftype][r]}
+
+        # cold ingestion: every load is a different document, so each one extracts, chunks and embeds
+        report["ingest"] = await run_scenario("ingest", [
+            post("/mcp/tools/load_material", load(t, r), r) for t in files for r in range(args.ingest_runs)], args.concurrency)
+        # the same loads again are no-ops against the stored pages
+        corpora = [(await c.post("/mcp/tools/load_material", json=load(t, 0), headers=hdr(0))).json()["corpus_id"]
+                   for t in files]
+        report["ingest_repeat"] = await run_scenario("ingest_repeat", [
+            post("/mcp/tools/load_material", load(t, 0), i)
+            for i, t in enumerate(list(files) * max(args.requests // len(files), 1))], args.concurrency)
+
+        def query():
+            return " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6)))
+        report["search"] = await run_scenario("search", [
+            post("/mcp/tools/answer_question", {"corpus_id": corpora[i % len(corpora)], "query": query()}, i)
+            for i in range(args.requests)], args.concurrency)
+        report["search_batch"] = await run_scenario("search_batch", [
+            post("/mcp/tools/answer_questions", {"corpus_id": corpora[i % len(corpora)],
+                 "queries": [query() for _ in range(args.batch)]}, i)
+            for i in range(max(args.requests // args.batch, 1))], args.concurrency)
+        report["notes"] = await run_scenario("notes", [
+            post("/mcp/tools/make_notes", {"corpus_id": corpora[i % len(corpora)]}, i)
+            for i in range(args.requests)], args.concurrency)
+
+        quiz_ids = []
+        async def quiz(i):
+            r = await c.post("/mcp/tools/generate_quiz", json={"corpus_id": corpora[i % len(corpora)], "items": 5},
+                             headers=hdr(i))
+            if r.status_code < 400: quiz_ids.append((i, r.json()["quiz_id"]))
+            return r
+        report["quiz"] = await run_scenario("quiz", [lambda i=i: quiz(i) for i in range(args.requests)], args.concurrency)
+
+        end = time.strftime("%Y-%m-%d", time.localtime(time.time() + 120 * 86400))
+        plan = {"mode": "spaced", "end_date": end, "days": ["Mon", "Wed", "Fri"], "window": "18:00-20:00"}
+        report["schedule"] = await run_scenario("schedule", [
+            post("/mcp/tools/schedule_quiz", {"quiz_id": q, "plan": plan, "tz": "America/New_York"}, i)
+            for i, q in quiz_ids], args.concurrency)
+
+        # notes PDFs render in the background; wait so their cost shows up in the stage totals
+        t0 = time.perf_counter()
+        from app import pdf
+        while any(n.endswith(".pending") for n in os.listdir(pdf.PDF_STATE_DIR)) and time.perf_counter() - t0 < 300:
+            await asyncio.sleep(0.1)
+        return {"scenarios": report, "stages": metrics.snapshot()}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pages", type=int, default=40, help="pages/slides per synthetic document")
+    ap.add_argument("--words", type=int, default=300, help="words per page/slide")
+    ap.add_argument("--types", default="pdf,pptx,docx")
+    ap.add_argument("--ingest-runs", type=int, default=2, help="documents loaded cold per type")
+    ap.add_argument("--requests", type=int, default=40, help="requests per query-side scenario")
+    ap.add_argument("--batch", type=int, default=10, help="questions per answer_questions call")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--users", type=int, default=4)
+    ap.add_argument("--llm-ms", type=float, default=300, help="fake OpenAI latency per call")
+    ap.add_argument("--auth-ms", type=float, default=0, help="fake session check latency")
+    ap.add_argument("--llm-cache", action="store_true", help="keep the LLM response cache on")
+    ap.add_argument("--workdir", help="default: a fresh temp dir")
+    ap.add_argument("--out", help="write the JSON report here (default: stdout)")
+    ap.add_argument("--baseline", help="earlier report to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.15)
+    args = ap.parse_args()
+
+    work = args.workdir or tempfile.mkdtemp(prefix="study-bench-")
+    # every store the app writes to lives under the work dir; set before the app is imported
+    for var, sub in (("STORE_DIR", "store"), ("QUIZ_DB", "quizzes.sqlite"),
+                     ("DOWNLOAD_DIR", "downloads"), ("ARTIFACT_DB", "artifacts.sqlite"),
+                     ("EMBED_CACHE_DIR", "embed_cache"), ("PDF_STATE_DIR", "pdf_jobs"),
+                     ("DOCX_INDEX_DIR", "docx_index")):
+        os.environ[var] = os.path.join(work, sub)
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    os.environ.setdefault("DESCOPE_PROJECT_ID", "bench")
+    if not args.llm_cache: os.environ["LLM_CACHE_SIZE"] = "0"
+
+    rng = random.Random(0)
+    docs = os.path.join(work, "docs")
+    os.makedirs(docs, exist_ok=True)
+    makers = {"pdf": make_pdf, "pptx": make_pptx, "docx": make_docx}
+    files = {}
+    t0 = time.perf_counter()
+    for ftype in args.types.split(","):
+        files[ftype] = [os.path.join(docs, f"bench-{r}.{ftype}") for r in range(args.ingest_runs)]
+        for path in files[ftype]:
+            makers[ftype](path, args.pages, args.words, rng)
+    print(f"documents generated in {time.perf_counter() - t0:.1f}s under {docs}", file=sys.stderr)
+
+    result = asyncio.run(bench(args, files))
+    from app import ingestion
+    if ingestion._pool is not None: ingestion._pool.shutdown()
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        rev = ""
+    report = {
+        "git": rev, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+        "cpus": os.cpu_count(), "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline")},
+        **result,
+        # ru_maxrss is KiB on Linux; children are the extraction pool processes
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_child_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            base = json.load(f)
+        report["regressions"] = compare(base, report, args.tolerance)
+    if not args.workdir: shutil.rmtree(work, ignore_errors=True)
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    if report.get("regressions"):
+        for r in report["regressions"]: print("REGRESSION", r, file=sys.stderr)
+        sys.exit(1)
+
+def compare(base: dict, cur: dict, tol: float) -> list:
+    out = []
+    for name, now in cur["scenarios"].items():
+        was = base.get("scenarios", {}).get(name)
+        if not was: continue
+        if was["p95_ms"] and now["p95_ms"] > was["p95_ms"] * (1 + tol):
+            out.append(f"{name}: p95 {was['p95_ms']} -> {now['p95_ms']} ms")
+        if was["throughput_rps"] and now["throughput_rps"] < was["throughput_rps"] * (1 - tol):
+            out.append(f"{name}: throughput {was['throughput_rps']} -> {now['throughput_rps']} req/s")
+    if base.get("peak_rss_mb") and cur["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tol):
+        out.append(f"peak RSS {base['peak_rss_mb']} -> {cur['peak_rss_mb']} MB")
+    return out
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# Render latency and peak memory of the PDF renderers on make_notes-shaped Markdown.
+#   python -m scripts.pdf_bench [--renderer pymupdf --renderer wkhtmltopdf] [--runs 20] [--sections 6]
+# Each renderer runs in its own interpreter, so peak RSS (ours + wkhtmltopdf children) is its own.
+import argparse, json, os, random, resource, subprocess, sys, tempfile, time
+
+def notes_md(sections: int, rng: random.Random) -> str:
+    # the shape NOTES_SYSTEM asks for: a few headed sections of short cited bullets
+    words = "gradient descent loss function matrix vector eigenvalue basis probability sample variance".split()
+    heads = ["Outline", "Key Terms", "Formulas", "Examples", "Self-Checks"]
+    out = []
+    for s in range(sections):
+        out.append(f"## {heads[s % len(heads)]}")
+        for _ in range(6):
+            out.append(f"- {' '.join(rng.choice(words) for _ in range(rng.randint(5, 12)))} (slide {rng.randint(1, 40)})")
+        out.append("")
+    out.append("| Term | Meaning |\n|---|---|\n| `x` | input |\n| `y` | output |")
+    return "\n".join(out)
+
+def child(renderer: str, runs: int, sections: int):
+    os.environ["PDF_RENDERER"] = renderer
+    from app import pdf
+    r = pdf.RENDERERS[renderer]
+    rng = random.Random(0)
+    docs = [pdf._wrap_html(pdf.markdown_to_html(notes_md(sections, rng))) for _ in range(runs)]
+    ms = []
+    with tempfile.TemporaryDirectory() as d:
+        for i, doc in enumerate(docs):
+            t0 = time.perf_counter()
+            r.render(doc, os.path.join(d, f"{i}.pdf"))
+            ms.append((time.perf_counter() - t0) * 1000)
+    ms.sort()
+    print(json.dumps({
+        "renderer": renderer, "runs": runs,
+        "mean_ms": round(sum(ms) / len(ms), 2), "p50_ms": round(ms[len(ms) // 2], 2),
+        "p95_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 2),
+        # ru_maxrss is KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_child_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }))
+
+ap = argparse.ArgumentParser()
+ap.add_argument("--renderer", action="append", choices=["pymupdf", "wkhtmltopdf"])
+ap.add_argument("--runs", type=int, default=20)
+ap.add_argument("--sections", type=int, default=6)
+ap.add_argument("--child", help=argparse.SUPPRESS)
+args = ap.parse_args()
+
+if args.child:
+    child(args.child, args.runs, args.sections)
+else:
+    reports = []
+    for name in args.renderer or ["pymupdf", "wkhtmltopdf"]:
+        p = subprocess.run([sys.executable, "-m", "scripts.pdf_bench", "--child", name,
+                            "--runs", str(args.runs), "--sections", str(args.sections)],
+                           capture_output=True, text=True)
+        reports.append(json.loads(p.stdout.strip().splitlines()[-1]) if p.returncode == 0
+                       else {"renderer": name, "error": (p.stderr.strip().splitlines() or ["failed"])[-1]})
+    print(json.dumps(reports, indent=2))